@@ -0,0 +1,210 @@
+"""Render many calendars and week diagrams at once, across a process pool.
+
+    $ python batch_render.py jobs.json
+
+The job file is a JSON list of jobs, or an object with a "jobs" list and a
+"defaults" object whose entries every job starts with. Each job is an
+object like this:
+
+    {"kind": "calendar", "output": "out/{name}-{start}.svg",
+     "start": "2018-06-01", "end": "2019-05-31", "latitude": 45,
+     "pageInches": 24, "topRadius": 475, "nextTopRadius": 600, "thickness": 70}
+
+"kind" is "calendar" (the default) or "week". "output" is the file to
+write, with {field} replaced by the job's other fields. The rest are the
+parameters of gen_calendar.writeCalendar (with "start" and "end" as dates)
+or gen_week.writeWeek; keys that aren't parameters, like "name" above, are
+just there for use in "output". A calendar job's "cache" names a directory
+for a fragment_cache.FragmentCache, which workers can safely share. Jobs
+whose output ends in ".pdf" are written as PDF, and those whose output ends
+in ".svgz" as gzipped SVG. "precision", "relative" and "pretty" choose how
+the SVG is written, as for gen_calendar.OutputProfile. A calendar job's
+"events" names an .ics or .csv file of events to draw over it. A job's
+"profile" names a file to write a profiling.Profiler report to, showing the
+time spent in each stage of drawing it.
+
+Any field whose value is a list makes a grid: the job is repeated once for
+each element. If the element is an object, its fields are merged into the
+job instead, which keeps related values, like a city's name and latitude,
+together:
+
+    {"output": "{name}-{start}.svg", "end": "...",
+     "start": ["2018-06-01", "2019-06-01"],
+     "place": [{"name": "portland", "latitude": 45},
+               {"name": "tokyo", "latitude": 35.7}]}
+
+is four jobs.
+"""
+
+import argparse
+import codecs
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+from datetime import datetime
+
+import gen_calendar
+import gen_week
+import pdf_backend
+from events import EventIndex, readEventFile
+from fragment_cache import FragmentCache
+from gen_calendar import OutputProfile
+from profiling import Profiler
+
+calendarParameters = ('latitude', 'pageInches', 'topRadius', 'nextTopRadius', 'thickness',
+                      'tolerance', 'stream', 'pdf', 'mergePaths', 'spiralStep')
+weekParameters = ('pageInches', 'radius', 'thickness', 'cycle', 'stream', 'pdf', 'reuse')
+profileParameters = ('precision', 'relative', 'pretty', 'compress')
+
+def parseDate(s):
+    return datetime.strptime(s, '%Y-%m-%d').date()
+
+# Return the list of jobs described by |spec|, the parsed contents of a job
+# file, with all grids expanded.
+def expandJobs(spec):
+    if isinstance(spec, dict):
+        defaults = spec.get('defaults', {})
+        jobs = spec['jobs']
+    else:
+        defaults = {}
+        jobs = spec
+    expanded = []
+    for job in jobs:
+        full = dict(defaults)
+        full.update(job)
+        expanded.extend(expandGrid(full))
+    return expanded
+
+def expandGrid(job):
+    gridKeys = sorted(k for k in job if isinstance(job[k], list))
+    for values in itertools.product(*[job[k] for k in gridKeys]):
+        j = dict((k, v) for (k, v) in job.items() if k not in gridKeys)
+        for (k, v) in zip(gridKeys, values):
+            if isinstance(v, dict):
+                j.update(v)
+            else:
+                j[k] = v
+        yield j
+
+def outputName(job):
+    return job['output'].format(**job)
+
+# Draw |job| and write it as SVG to the file |out|, ignoring its "output".
+# If the job says to compress, |out| should be a binary file.
+def writeJob(job, out):
+    if job.get('profile'):
+        profiler = Profiler()
+        with profiler.installed(gen_calendar, gen_week, pdf_backend):
+            drawJob(job, out)
+        profiler.write(job['profile'])
+    else:
+        drawJob(job, out)
+
+def drawJob(job, out):
+    profile = OutputProfile(**dict((k, job[k]) for k in profileParameters if k in job))
+    if job.get('kind', 'calendar') == 'calendar':
+        options = dict((k, job[k]) for k in calendarParameters if k in job)
+        if job.get('cache'):
+            options['cache'] = FragmentCache(job['cache'])
+        if job.get('events'):
+            options['events'] = EventIndex(readEventFile(job['events']))
+        gen_calendar.writeCalendar(out, parseDate(job['start']), parseDate(job['end']),
+                                   profile=profile, **options)
+    else:
+        gen_week.writeWeek(out, profile=profile,
+                           **dict((k, job[k]) for k in weekParameters if k in job))
+
+# Render |job|, returning a dictionary describing how it went: the output
+# file, the time taken in seconds, and the text of the exception if the job
+# failed. This runs in the pool's worker processes.
+#
+# The drawing is written to a temporary file beside the output and renamed
+# into place only once it is complete, so a failed job leaves no empty or
+# truncated file that looks like real output.
+def renderJob(job):
+    output = outputName(job)
+    start = time.time()
+    try:
+        if job.get('kind', 'calendar') not in ('calendar', 'week'):
+            raise ValueError("unknown job kind: %r" % (job['kind'],))
+        directory = os.path.dirname(output)
+        if directory and not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Another worker may have just created it.
+                if not os.path.isdir(directory):
+                    raise
+        temporary = '%s.%d.tmp' % (output, os.getpid())
+        if output.endswith('.pdf'):
+            job = dict(job, pdf=True)
+            f = open(temporary, 'wb')
+        elif output.endswith('.svgz'):
+            job = dict(job, compress=True)
+            f = open(temporary, 'wb')
+        else:
+            f = codecs.open(temporary, 'w', encoding='utf-8')
+        try:
+            with f:
+                writeJob(job, f)
+            os.rename(temporary, output)
+        except:
+            os.remove(temporary)
+            raise
+        error = None
+    except Exception:
+        error = traceback.format_exc()
+    return {'output': output, 'seconds': time.time() - start, 'error': error}
+
+# Render all of |jobs| on a pool of |processes| processes (by default, one
+# per CPU), reporting progress to |log|. Return the list of results from
+# renderJob, in order of completion.
+def renderAll(jobs, processes=None, log=sys.stderr):
+    pool = multiprocessing.Pool(processes)
+    results = []
+    try:
+        for result in pool.imap_unordered(renderJob, jobs):
+            results.append(result)
+            print >> log, '[%d/%d] %s %.2fs%s' % (len(results), len(jobs), result['output'],
+                                                 result['seconds'],
+                                                 ' FAILED' if result['error'] else '')
+            if result['error']:
+                print >> log, result['error']
+    finally:
+        pool.close()
+        pool.join()
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Render a batch of calendars across a process pool.")
+    parser.add_argument('jobs', help="JSON file describing the jobs to render")
+    parser.add_argument('-j', '--processes', type=int, default=None,
+                        help="number of worker processes (default: one per CPU)")
+    parser.add_argument('--cache', metavar='DIRECTORY',
+                        help="share a fragment cache in this directory among calendar jobs "
+                        "that don't name their own")
+    parser.add_argument('--timings', metavar='JSON',
+                        help="write each job's output file, time and error to this file")
+    args = parser.parse_args()
+
+    with open(args.jobs) as f:
+        jobs = expandJobs(json.load(f))
+    if args.cache:
+        for job in jobs:
+            job.setdefault('cache', args.cache)
+
+    start = time.time()
+    results = renderAll(jobs, args.processes)
+    failures = [r for r in results if r['error']]
+    print >> sys.stderr, '%d jobs, %d failed, %.2fs' % (len(results), len(failures), time.time() - start)
+
+    if args.timings:
+        with open(args.timings, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            print >> f
+
+    sys.exit(1 if failures else 0)
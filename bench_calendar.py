@@ -0,0 +1,184 @@
+"""Time the stages of drawing a calendar, and save the results as JSON.
+
+    $ python bench_calendar.py -o before.json
+    ... change something ...
+    $ python bench_calendar.py -o after.json --compare before.json
+
+Each stage is timed separately: Spiral coordinate math, the parts of
+Calendar.element (including an overlay of a century's worth of synthetic
+events), Week.element, and serialization with writexml. Stages
+are run for calendars spanning several numbers of years and, where it
+matters, several spiral step sizes. Everything runs offline, writing to
+memory rather than to files.
+"""
+
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+from StringIO import StringIO
+from datetime import date, datetime, timedelta
+
+import gen_calendar
+from gen_calendar import Calendar, DayLengthTable, SVGPicture, Spiral, dateRange, yearLength
+from events import Event, EventIndex
+from gen_week import CircularBand, Week
+
+pageSizeInches = ('24in', '24in')
+pageSize = (24 * 72, 24 * 72)
+center = (pageSize[0]/2, pageSize[1]/2)
+topDate = date(2018, 1, 1)
+startDate = date(2018, 6, 1)
+latitude = 45
+
+def makeSpiral():
+    return Spiral(center=center,
+                  topDate = topDate, nextTopDate = topDate + yearLength,
+                  topRadius = 475, nextTopRadius = 600, thickness = 70)
+
+# Return a Calendar covering |years| years, drawing its spiral edges in
+# |step|-day arcs, on a fresh picture. Give it its own DayLengthTable, so
+# that frame timings include computing the day lengths.
+def makeCalendar(years, step):
+    endDate = date(startDate.year + years, startDate.month, startDate.day) - timedelta(1)
+    return Calendar(SVGPicture(pageSizeInches, pageSize), makeSpiral(),
+                    startDate, endDate, latitude, dayLengths=DayLengthTable(),
+                    spiralStep=step)
+
+# Return an EventIndex of |count| made-up events spread over the hundred
+# years from startDate: mostly single days and hour-long appointments, with
+# some longer breaks.
+def makeEvents(count=20000):
+    generator = random.Random(0)
+    events = []
+    for i in xrange(count):
+        start = datetime(startDate.year, 1, 1) + timedelta(generator.randrange(100 * 365))
+        length = generator.choice([timedelta(hours=1), timedelta(1), timedelta(1), timedelta(14)])
+        if length < timedelta(1):
+            start = start + timedelta(hours=generator.randrange(8, 18))
+        events.append(Event('event %d' % i, start, start + length))
+    return EventIndex(events)
+
+# Call |setup| and then |run| on its result |repeat| times, returning a list
+# of the times taken by |run| alone, in seconds.
+def timeRuns(setup, run, repeat):
+    times = []
+    for i in xrange(repeat):
+        arg = setup()
+        start = time.time()
+        run(arg)
+        times.append(time.time() - start)
+    return times
+
+# Yield (name, parameters, setup, run) for each benchmark.
+def benchmarks(spans, steps):
+    events = makeEvents()
+    for years in spans:
+        # Coordinate math: every day, at the inner edge, middle and outer
+        # edge of the spiral, one point at a time.
+        def days(years=years):
+            cal = makeCalendar(years, 10)
+            return (cal.spiral, list(dateRange(cal.startDate, cal.endDate, 1)))
+        def toXY((spiral, dates)):
+            for d in dates:
+                spiral.toXY(d, 0)
+                spiral.toXY(d, 0.5)
+                spiral.toXY(d, 1)
+        yield ('spiral.toXY', {'years': years}, days, toXY)
+
+        if gen_calendar.numpy is not None:
+            def toXYs((spiral, dates)):
+                for r in (0, 0.5, 1):
+                    spiral.toXYs(dates, r)
+            yield ('spiral.toXYs', {'years': years}, days, toXYs)
+
+        yield ('monthSections', {'years': years},
+               lambda years=years: makeCalendar(years, 10), Calendar.monthSections)
+        yield ('monthLabels', {'years': years},
+               lambda years=years: makeCalendar(years, 10), Calendar.monthLabels)
+
+        def withEvents(years=years):
+            cal = makeCalendar(years, 10)
+            cal.events = events
+            return cal
+        yield ('eventOverlay', {'years': years, 'events': len(events)}, withEvents,
+               Calendar.eventOverlay)
+
+        # Daylight bands for several other latitudes, day lengths included.
+        def withComparisons(years=years):
+            cal = makeCalendar(years, 10)
+            cal.comparisons = [35.7, 51.5, 60]
+            return cal
+        yield ('latitudeBands', {'years': years, 'latitudes': 3}, withComparisons,
+               Calendar.latitudeBands)
+
+        for step in steps:
+            yield ('frame', {'years': years, 'step': step},
+                   lambda years=years, step=step: makeCalendar(years, step), Calendar.frame)
+
+            # Serialization of a complete picture, pretty-printed as the
+            # script does, and without indentation.
+            def picture(years=years, step=step):
+                cal = makeCalendar(years, step)
+                cal.element(cal.picture.root)
+                return cal.picture
+            yield ('writexml', {'years': years, 'step': step}, picture,
+                   lambda picture: picture.doc.writexml(StringIO(), addindent='  ', newl='\n'))
+            yield ('writexml.compact', {'years': years, 'step': step}, picture,
+                   lambda picture: picture.doc.writexml(StringIO()))
+
+    def week():
+        return Week(SVGPicture(('18in', '18in'), (18*72, 18*72)),
+                    CircularBand((9*72, 9*72), radius=350, thickness=200, cycle=7))
+    yield ('week.element', {}, week, Week.element)
+
+def describe(name, params):
+    return ' '.join([name] + ['%s=%s' % (k, params[k]) for k in sorted(params)])
+
+# Compare |results| with those of an earlier run, |previous|, and print the
+# ratio of the best times for each benchmark the two runs share.
+def compare(results, previous, out):
+    old = dict((describe(r['name'], r['params']), r['best']) for r in previous['results'])
+    for r in results:
+        key = describe(r['name'], r['params'])
+        if key in old:
+            print >> out, '%-40s %10.4fs -> %10.4fs  x%.2f' % (key, old[key], r['best'],
+                                                              r['best'] / old[key] if old[key] else 0)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the stages of drawing a calendar.")
+    parser.add_argument('-o', '--output', default='bench.json',
+                        help="file to write the JSON results to (default: %(default)s)")
+    parser.add_argument('--spans', type=int, nargs='+', default=[1, 10, 100], metavar='YEARS',
+                        help="calendar lengths to try, in years (default: 1 10 100)")
+    parser.add_argument('--steps', type=int, nargs='+', default=[1, 10, 30], metavar='DAYS',
+                        help="spiral step sizes to try, in days (default: 1 10 30)")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="times to run each benchmark (default: %(default)s)")
+    parser.add_argument('--compare', metavar='JSON',
+                        help="results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    results = []
+    for (name, params, setup, run) in benchmarks(args.spans, args.steps):
+        times = timeRuns(setup, run, args.repeat)
+        results.append({'name': name, 'params': params,
+                        'best': min(times), 'mean': sum(times) / len(times), 'times': times})
+        print >> sys.stderr, '%-40s %10.4fs' % (describe(name, params), min(times))
+
+    report = {
+        'when': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'numpy': gen_calendar.numpy.__version__ if gen_calendar.numpy is not None else None,
+        'repeat': args.repeat,
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+        print >> f
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f), sys.stdout)
@@ -0,0 +1,251 @@
+"""A small HTTP server that draws calendars and week diagrams on request.
+
+    $ python calendar_server.py --port 8000
+    $ curl 'http://localhost:8000/calendar.svg?start=2018-06-01&end=2019-05-31&latitude=45'
+    $ curl 'http://localhost:8000/week.svg?radius=350&thickness=200'
+
+Query parameters are those of batch_render.py's jobs: for calendars,
+"start" and "end" (required, as YYYY-MM-DD), "latitude" (required),
+"pageInches", "topRadius", "nextTopRadius", "thickness", "tolerance",
+"spiralStep" and "mergePaths"; for week diagrams, "pageInches", "radius",
+"thickness", "cycle" and "reuse"; and for both, "precision", "relative" and
+"pretty". Values outside sensible ranges, and calendars spanning more than
+a century, get a 400 response. Asking for calendar.svgz or week.svgz instead gets the same
+drawing gzipped, sent with "Content-Encoding: gzip".
+
+The server keeps the most recently requested drawings in memory, and
+answers repeated requests from there. Every response carries an ETag, and
+a request whose If-None-Match matches gets a 304 with no body.
+
+Each request is handled on its own thread, and the drawing itself happens
+in a pool of worker processes, so a slow drawing never holds up the
+server's other requests. Identical requests that arrive while a drawing is
+in progress share its result. A request whose drawing takes longer than
+--timeout seconds gets a 503 response; the drawing carries on, and a
+retry waits for it, or is answered from the cache once it is done.
+"""
+
+import argparse
+import codecs
+import hashlib
+import multiprocessing
+import sys
+import threading
+import urlparse
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from StringIO import StringIO
+from collections import OrderedDict
+
+from batch_render import parseDate, writeJob
+
+def flag(s):
+    return s.lower() in ('1', 'true', 'yes', 'on')
+
+def dateString(s):
+    return parseDate(s).isoformat()
+
+# Return a function that converts a string with |convert|, and raises
+# ValueError unless the result is between |low| and |high| inclusive.
+# Without these limits, a zero spiral step or tolerance would keep a worker
+# busy forever.
+def bounded(convert, low, high):
+    def check(s):
+        value = convert(s)
+        if not low <= value <= high:
+            raise ValueError("must be between %g and %g" % (low, high))
+        return value
+    return check
+
+# For each kind of drawing, the query parameters it accepts, and functions
+# to check and convert their values.
+queryParameters = {
+    'calendar': {
+        'start': dateString, 'end': dateString, 'latitude': bounded(float, -90, 90),
+        'pageInches': bounded(float, 1, 100), 'topRadius': bounded(float, 1, 5000),
+        'nextTopRadius': bounded(float, 1, 5000), 'thickness': bounded(float, 1, 1000),
+        'tolerance': bounded(float, 0.01, 100), 'spiralStep': bounded(int, 1, 366),
+        'mergePaths': flag,
+    },
+    'week': {
+        'pageInches': bounded(float, 1, 100), 'radius': bounded(float, 1, 5000),
+        'thickness': bounded(float, 1, 5000), 'cycle': bounded(int, 1, 366), 'reuse': flag,
+    },
+}
+for parameters in queryParameters.values():
+    parameters.update({'precision': bounded(int, 0, 6), 'relative': flag, 'pretty': flag})
+requiredParameters = {
+    'calendar': ('start', 'end', 'latitude'),
+    'week': (),
+}
+
+# The longest calendar, in days, the server will draw.
+maxCalendarDays = 366 * 100
+
+# Raise ValueError if the parameters of |job|, a calendar, don't make sense
+# together.
+def checkCalendar(job):
+    (start, end) = (parseDate(job['start']), parseDate(job['end']))
+    if end <= start:
+        raise ValueError("end must be after start")
+    if (end - start).days > maxCalendarDays:
+        raise ValueError("calendars may span at most %d days" % (maxCalendarDays,))
+    if job.get('nextTopRadius', 600) <= job.get('topRadius', 475):
+        raise ValueError("nextTopRadius must be greater than topRadius")
+
+# Return the job for a request for |path| with the query string |query|.
+# Raise ValueError if the request doesn't make sense.
+def parseRequest(path, query):
+    (kind, dot, extension) = path[1:].rpartition('.')
+    if not path.startswith('/') or extension not in ('svg', 'svgz') or kind not in queryParameters:
+        raise ValueError("unknown path: %s" % (path,))
+    job = {'kind': kind}
+    if extension == 'svgz':
+        job['compress'] = True
+    for (name, values) in urlparse.parse_qs(query).items():
+        if name not in queryParameters[kind]:
+            raise ValueError("unknown parameter: %s" % (name,))
+        try:
+            job[name] = queryParameters[kind][name](values[-1])
+        except ValueError as e:
+            raise ValueError("bad value for %s: %s (%s)" % (name, values[-1], e))
+    for name in requiredParameters[kind]:
+        if name not in job:
+            raise ValueError("missing parameter: %s" % (name,))
+    if kind == 'calendar':
+        checkCalendar(job)
+    return job
+
+# Draw |job|, returning the SVG as UTF-8, or gzipped if the job says to
+# compress. This runs in the worker processes.
+def renderJob(job):
+    out = StringIO()
+    writeJob(job, out if job.get('compress') else codecs.getwriter('utf-8')(out))
+    return out.getvalue()
+
+# A least-recently-used cache of rendered drawings, safe to use from
+# several threads, which also makes concurrent requests for the same
+# drawing wait for a single rendering. Waiting more than |timeout| seconds
+# for a rendering raises multiprocessing.TimeoutError, but the rendering
+# carries on, and goes into the cache when it finishes; requests for it
+# meanwhile wait for the same rendering, rather than starting another.
+class RenderCache(object):
+    def __init__(self, pool, size, timeout=None):
+        self.pool = pool
+        self.size = size
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()        # key -> (etag, body)
+        self.pending = {}                   # key -> AsyncResult
+
+    # Return (etag, body) for |job|, rendering it if necessary.
+    def get(self, job):
+        key = tuple(sorted(job.items()))
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.entries[key] = entry
+                return entry
+            result = self.pending.get(key)
+            if result is None:
+                result = self.pending[key] = self.pool.apply_async(
+                    renderJob, (job,), callback=lambda body: self.store(key, body))
+
+        try:
+            body = result.get(self.timeout)
+        except multiprocessing.TimeoutError:
+            raise
+        except Exception:
+            # The rendering failed; let the next request try again.
+            with self.lock:
+                if self.pending.get(key) is result:
+                    del self.pending[key]
+            raise
+
+        # store has run by now, but the entry may already have been pushed
+        # out of the cache.
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None or entry[1] is not body:
+            entry = self.entry(body)
+        return entry
+
+    # Put |body|, the finished rendering for |key|, in the cache. This runs
+    # on the pool's result-handling thread.
+    def store(self, key, body):
+        entry = self.entry(body)
+        with self.lock:
+            self.pending.pop(key, None)
+            self.entries[key] = entry
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def entry(self, body):
+        return ('"%s"' % hashlib.sha1(body).hexdigest(), body)
+
+class RenderHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse.urlsplit(self.path)
+        try:
+            job = parseRequest(url.path, url.query)
+        except ValueError as e:
+            self.send_error(404 if str(e).startswith('unknown path') else 400, str(e))
+            return
+
+        try:
+            (etag, body) = self.server.cache.get(job)
+        except multiprocessing.TimeoutError:
+            self.send_error(503, "drawing took too long")
+            return
+        except Exception as e:
+            self.send_error(500, str(e))
+            return
+
+        tags = [t.strip() for t in self.headers.get('If-None-Match', '').split(',')]
+        if etag in tags or '*' in tags:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/svg+xml; charset=utf-8')
+        if job.get('compress'):
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+class RenderServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, cache):
+        HTTPServer.__init__(self, address, RenderHandler)
+        self.cache = cache
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve calendars and week diagrams over HTTP.")
+    parser.add_argument('--host', default='127.0.0.1',
+                        help="address to listen on (default: %(default)s)")
+    parser.add_argument('--port', type=int, default=8000,
+                        help="port to listen on (default: %(default)s)")
+    parser.add_argument('-j', '--processes', type=int, default=None,
+                        help="number of drawing processes (default: one per CPU)")
+    parser.add_argument('--cache-size', type=int, default=100,
+                        help="number of drawings to keep in memory (default: %(default)s)")
+    parser.add_argument('--timeout', type=float, default=60,
+                        help="seconds to wait for a drawing before giving up "
+                        "(default: %(default)s)")
+    args = parser.parse_args()
+
+    pool = multiprocessing.Pool(args.processes)
+    cache = RenderCache(pool, args.cache_size, args.timeout)
+    server = RenderServer((args.host, args.port), cache)
+    print >> sys.stderr, 'serving on http://%s:%d/' % server.server_address
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pool.terminate()
@@ -0,0 +1,369 @@
+"""Check that a fixed set of calendars and week diagrams still come out the
+same, and no slower, than when their golden copies were recorded.
+
+    $ python check_golden.py             # check everything
+    $ python check_golden.py --update    # accept the current output and timings
+
+Each configuration in |configurations| is drawn in a child process of its
+own. Its SVG is compared with golden/NAME.svgz element by element: the
+same elements and attributes in the same order, the same text, and the
+same numbers, to within --tolerance. Path data is compared as absolute
+commands, so coordinates that round differently still match. Up to
+--show differences are printed for each configuration. A configuration
+whose process crashes, or runs longer than --timeout seconds, fails.
+
+Each configuration is drawn --repeat times with a profiling.Profiler
+installed and --repeat times without, and the best times are compared with
+golden/budgets.json: the whole drawing's time, each stage's time, and how
+much the process's peak memory grew while drawing. Times are processor
+time, which other work on the machine disturbs less than wall-clock time.
+A stage fails if it takes more than its budget by the fraction --slack
+(plus ten milliseconds, for timer noise), and memory fails if it grows by
+more than its budget by --memory-slack (plus a megabyte). Only stages
+taking five milliseconds or more get budgets. Day lengths are memoized,
+so each calendar's are also timed apart from drawing, computed from
+scratch dayLengthRepeats times over, as the stage coldDayLengths. Budgets are only as good as
+the machine they were recorded on, so record them where the checks run.
+
+The script exits with status 1 if anything failed.
+"""
+
+import argparse
+import gzip
+import json
+import multiprocessing
+import os
+import platform
+import re
+import resource
+import sys
+import time
+import xml.dom.minidom
+from StringIO import StringIO
+from datetime import date, datetime
+
+import gen_calendar
+import gen_week
+from events import Event, EventIndex
+from fragment_cache import makeDirectories
+from gen_calendar import DETAIL_WEEKS, DayLengthTable, OutputProfile, PathBuilder
+from profiling import Profiler
+
+goldenDirectory = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'golden')
+
+# A few fixed events, for the configurations that draw them.
+def fixedEvents():
+    return EventIndex([
+        Event(u'Birthday', datetime(2018, 9, 14), datetime(2018, 9, 15), True),
+        Event(u'Winter break', datetime(2018, 12, 22), datetime(2019, 1, 3), True),
+        Event(u'Dentist', datetime(2018, 10, 3, 9), datetime(2018, 10, 3, 10)),
+        Event(u'Launch', datetime(2019, 3, 2, 14), datetime(2019, 3, 2, 14)),
+    ])
+
+year = {'startDate': date(2018, 6, 1), 'endDate': date(2019, 5, 31), 'latitude': 45}
+
+# (name, kind, writeCalendar or writeWeek arguments, OutputProfile arguments)
+configurations = [
+    ('calendar', 'calendar', {}, {}),
+    ('calendar-merge', 'calendar', {'mergePaths': True}, {}),
+    ('calendar-tolerance', 'calendar', {'tolerance': 0.5}, {}),
+    ('calendar-compact', 'calendar', {}, {'precision': 2, 'relative': True, 'pretty': False}),
+    ('calendar-weeks', 'calendar', {'detail': DETAIL_WEEKS}, {}),
+    ('calendar-events', 'calendar', {'events': fixedEvents, 'today': date(2018, 10, 3)}, {}),
+    ('calendar-comparisons', 'calendar', {'comparisons': [35.7, 60]}, {}),
+    ('calendar-decade', 'calendar',
+     {'startDate': date(2010, 1, 1), 'endDate': date(2019, 12, 31), 'mergePaths': True}, {}),
+    ('week', 'week', {}, {}),
+    ('week-reuse', 'week', {'reuse': True}, {'relative': True}),
+]
+
+# Stages to give budgets however quick they are.
+alwaysBudgeted = ('total', 'coldDayLengths')
+
+# How many times to compute a calendar's day lengths from scratch for the
+# coldDayLengths stage. Once takes well under a millisecond, too little to
+# time reliably.
+dayLengthRepeats = 1000
+
+# Return (kind, arguments, profile arguments) for the configuration |name|.
+def configuration(name):
+    [found] = [(k, a, p) for (n, k, a, p) in configurations if n == name]
+    return found
+
+# Draw the configuration |name|, returning its SVG as a string. Calendars
+# get a DayLengthTable of their own, rather than the process-wide
+# defaultDayLengths, so that every drawing pays for its day lengths, as a
+# fresh process would.
+def render(name):
+    (kind, arguments, profileArguments) = configuration(name)
+    arguments = dict(arguments)
+    if 'events' in arguments:
+        arguments['events'] = arguments['events']()
+    profile = OutputProfile(**profileArguments)
+    out = StringIO()
+    if kind == 'calendar':
+        options = dict(year, dayLengths=DayLengthTable())
+        options.update(arguments)
+        gen_calendar.writeCalendar(out, options.pop('startDate'), options.pop('endDate'),
+                                   options.pop('latitude'), profile=profile, **options)
+    else:
+        gen_week.writeWeek(out, profile=profile, **arguments)
+    return out.getvalue()
+
+# Return the seconds it takes to compute the day lengths the calendar
+# configuration |name| draws, at its own latitude and any it compares,
+# from scratch dayLengthRepeats times over, or None if it isn't a calendar.
+def timeDayLengths(name):
+    (kind, arguments, profileArguments) = configuration(name)
+    if kind != 'calendar':
+        return None
+    options = dict(year)
+    options.update(arguments)
+    (latitude, first, last) = (options['latitude'], options['startDate'], options['endDate'])
+    comparisons = options.get('comparisons')
+    start = time.clock()
+    for i in xrange(dayLengthRepeats):
+        table = DayLengthTable()
+        table.lengths(latitude, first, last)
+        if comparisons:
+            table.grid(comparisons, first, last)
+    return time.clock() - start
+
+# Return the peak resident memory of this process so far, in kilobytes.
+def peakKilobytes():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 if sys.platform == 'darwin' else peak
+
+# Draw |name| |repeat| times with and without a Profiler, and send back
+# its SVG and measurements on |connection|. This runs in a child process,
+# so that its peak memory is its own.
+def measure(name, repeat, connection):
+    try:
+        startPeak = peakKilobytes()
+        (svg, total) = (None, [])
+        for i in xrange(repeat):
+            start = time.clock()
+            svg = render(name)
+            total.append(time.clock() - start)
+        peak = peakKilobytes() - startPeak
+
+        stages = {}
+        for i in xrange(repeat):
+            profiler = Profiler(clock=time.clock)
+            with profiler.installed(gen_calendar, gen_week):
+                render(name)
+            for stage in profiler.report()['stages']:
+                stages[stage['name']] = min(stages.get(stage['name'], stage['seconds']),
+                                            stage['seconds'])
+        stages['total'] = min(total)
+        cold = [timeDayLengths(name) for i in xrange(repeat)]
+        if cold[0] is not None:
+            stages['coldDayLengths'] = min(cold)
+        connection.send((svg, {'seconds': stages, 'peakKB': peak}, None))
+    except Exception:
+        import traceback
+        connection.send((None, None, traceback.format_exc()))
+    connection.close()
+
+# Run measure for |name| in a child process, and return what it sends
+# back. If the child dies without answering, or takes more than |timeout|
+# seconds, return an error instead.
+def runMeasurement(name, repeat, timeout):
+    (parent, child) = multiprocessing.Pipe(False)
+    process = multiprocessing.Process(target=measure, args=(name, repeat, child))
+    process.start()
+    # Close our copy of the child's end, so that we see end-of-file if the
+    # child exits without sending anything.
+    child.close()
+    try:
+        if not parent.poll(timeout):
+            process.terminate()
+            result = (None, None, 'gave up after %g seconds' % (timeout,))
+        else:
+            result = parent.recv()
+    except EOFError:
+        result = None
+    process.join()
+    if result is None:
+        result = (None, None, 'drawing process exited with status %s' % (process.exitcode,))
+    return result
+
+numberPattern = re.compile(r'[-+]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][-+]?[0-9]+)?')
+
+# Return whether the numbers |a| and |b| differ by no more than
+# |tolerance|.
+def close(a, b, tolerance):
+    return abs(a - b) <= tolerance + 1e-9
+
+# Compare the attribute values |golden| and |actual|: the text between
+# their numbers must match exactly, and the numbers to within |tolerance|.
+def sameValue(golden, actual, tolerance):
+    if numberPattern.sub('#', golden) != numberPattern.sub('#', actual):
+        return False
+    return all(close(float(g), float(a), tolerance)
+               for (g, a) in zip(numberPattern.findall(golden), numberPattern.findall(actual)))
+
+# Compare the path data |golden| and |actual| as absolute commands.
+def samePath(golden, actual, tolerance):
+    try:
+        (g, a) = (PathBuilder.fromString(golden), PathBuilder.fromString(actual))
+    except ValueError:
+        return golden == actual
+    if list(g.codes) != list(a.codes):
+        return False
+    return all(close(x, y, tolerance) for (x, y) in zip(g.coords, a.coords))
+
+def describe(value, limit=60):
+    return repr(value if len(value) <= limit else value[:limit] + '...')
+
+# Yield a description of each difference between the elements |golden| and
+# |actual|, whose location in the document is |where|.
+def differences(golden, actual, where, tolerance):
+    if golden.tagName != actual.tagName:
+        yield '%s: expected <%s>, got <%s>' % (where, golden.tagName, actual.tagName)
+        return
+    (ga, aa) = (dict(golden.attributes.items()), dict(actual.attributes.items()))
+    for name in sorted(set(ga) | set(aa)):
+        if name not in aa:
+            yield '%s: missing attribute %s' % (where, name)
+        elif name not in ga:
+            yield '%s: unexpected attribute %s=%s' % (where, name, describe(aa[name]))
+        elif not (samePath if name == 'd' else sameValue)(ga[name], aa[name], tolerance):
+            yield '%s: %s was %s, now %s' % (where, name, describe(ga[name]),
+                                             describe(aa[name]))
+
+    def children(e):
+        return [c for c in e.childNodes if c.nodeType == c.ELEMENT_NODE]
+    def text(e):
+        return ''.join(c.data for c in e.childNodes if c.nodeType == c.TEXT_NODE).strip()
+    if text(golden) != text(actual):
+        yield '%s: text was %s, now %s' % (where, describe(text(golden)), describe(text(actual)))
+
+    (gc, ac) = (children(golden), children(actual))
+    if len(gc) != len(ac):
+        yield '%s: expected %d children, got %d' % (where, len(gc), len(ac))
+    counts = {}
+    for (g, a) in zip(gc, ac):
+        counts[g.tagName] = counts.get(g.tagName, 0) + 1
+        for d in differences(g, a, '%s/%s[%d]' % (where, g.tagName, counts[g.tagName]),
+                             tolerance):
+            yield d
+
+def goldenFile(name):
+    return os.path.join(goldenDirectory, name + '.svgz')
+
+def readGolden(name):
+    with open(goldenFile(name), 'rb') as f:
+        return gzip.GzipFile(fileobj=f).read()
+
+def writeGolden(name, svg):
+    with open(goldenFile(name), 'wb') as f:
+        gz = gzip.GzipFile(filename='', mode='wb', fileobj=f, mtime=0)
+        gz.write(svg.encode('utf-8') if isinstance(svg, unicode) else svg)
+        gz.close()
+
+# Return a list of descriptions of the ways |measured| exceeds |budget|.
+def overBudget(budget, measured, slack, memorySlack):
+    problems = []
+    for (stage, seconds) in sorted(budget['seconds'].items()):
+        now = measured['seconds'].get(stage)
+        if now is not None and now > seconds * (1 + slack) + 0.01:
+            problems.append('%s took %.4fs, budget %.4fs' % (stage, now, seconds))
+    if measured['peakKB'] > budget['peakKB'] * (1 + memorySlack) + 1024:
+        problems.append('peak memory grew by %dKB, budget %dKB' % (measured['peakKB'],
+                                                                 budget['peakKB']))
+    return problems
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Check drawings against their golden copies "
+                                     "and performance budgets.")
+    parser.add_argument('--update', action='store_true',
+                        help="write the current drawings and timings as the new golden ones")
+    parser.add_argument('--only', metavar='NAME', action='append',
+                        help="check just this configuration; may be repeated")
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help="how far numbers may move, in SVG user units (default: %(default)s)")
+    parser.add_argument('--repeat', type=int, default=5,
+                        help="draw each configuration this many times, keeping the best "
+                        "times (default: %(default)s)")
+    parser.add_argument('--slack', type=float, default=0.5,
+                        help="fraction by which a stage may exceed its time budget "
+                        "(default: %(default)s)")
+    parser.add_argument('--memory-slack', type=float, default=0.2,
+                        help="fraction by which peak memory may exceed its budget "
+                        "(default: %(default)s)")
+    parser.add_argument('--no-budgets', action='store_true',
+                        help="only compare the drawings")
+    parser.add_argument('--show', type=int, default=10,
+                        help="differences to print per configuration (default: %(default)s)")
+    parser.add_argument('--timeout', type=float, default=300,
+                        help="seconds to allow each configuration, for all its drawings "
+                        "(default: %(default)s)")
+    args = parser.parse_args()
+
+    names = [n for (n, k, a, p) in configurations]
+    if args.only:
+        unknown = set(args.only) - set(names)
+        if unknown:
+            parser.error("unknown configuration: %s" % ', '.join(sorted(unknown)))
+        names = [n for n in names if n in args.only]
+
+    budgetFile = os.path.join(goldenDirectory, 'budgets.json')
+    budgets = {'configurations': {}}
+    if os.path.exists(budgetFile):
+        with open(budgetFile) as f:
+            budgets = json.load(f)
+
+    failures = 0
+    for name in names:
+        (svg, measured, error) = runMeasurement(name, args.repeat, args.timeout)
+        if error:
+            print '%-24s FAILED to draw\n%s' % (name, error)
+            failures += 1
+            continue
+
+        if args.update:
+            makeDirectories(goldenDirectory)
+            writeGolden(name, svg)
+            # Stages quicker than this are mostly timer noise.
+            measured['seconds'] = dict((s, t) for (s, t) in measured['seconds'].items()
+                                       if t >= 0.005 or s in alwaysBudgeted)
+            budgets['configurations'][name] = measured
+            print '%-24s recorded, %.4fs, %dKB' % (name, measured['seconds']['total'],
+                                                   measured['peakKB'])
+            continue
+
+        problems = []
+        if not os.path.exists(goldenFile(name)):
+            problems.append('no golden file; run with --update to record one')
+        else:
+            golden = xml.dom.minidom.parseString(readGolden(name)).documentElement
+            actual = xml.dom.minidom.parseString(svg.encode('utf-8')
+                                                 if isinstance(svg, unicode) else svg)
+            found = list(differences(golden, actual.documentElement, 'svg', args.tolerance))
+            problems.extend(found[:args.show])
+            if len(found) > args.show:
+                problems.append('... and %d more differences' % (len(found) - args.show))
+
+        budget = budgets['configurations'].get(name)
+        if not args.no_budgets:
+            if budget is None:
+                problems.append('no budget; run with --update to record one')
+            else:
+                problems.extend(overBudget(budget, measured, args.slack, args.memory_slack))
+
+        print '%-24s %s, %.4fs, %dKB' % (name, 'FAILED' if problems else 'ok',
+                                         measured['seconds']['total'], measured['peakKB'])
+        for p in problems:
+            print '    ' + p
+        failures += bool(problems)
+
+    if args.update:
+        budgets.update({'when': datetime.now().isoformat(), 'python': platform.python_version(),
+                        'machine': platform.platform()})
+        with open(budgetFile, 'w') as f:
+            json.dump(budgets, f, indent=2, sort_keys=True)
+            print >> f
+    else:
+        print '%d of %d configurations failed' % (failures, len(names))
+    sys.exit(1 if failures else 0)
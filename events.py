@@ -0,0 +1,249 @@
+"""Read calendar events from iCalendar or CSV files, and index them by date.
+
+    index = EventIndex(readEventFile('district.ics'))
+    for event in index.overlapping(startDate, endDate):
+        ...
+
+readEventFile understands .ics files (VEVENT components with DTSTART and
+either DTEND or DURATION; recurrence rules are not expanded) and CSV files
+with a header row in the style of Google Calendar and Outlook exports:
+"Subject", "Start Date" and optionally "Start Time", "End Date", "End Time"
+and "All Day Event". Times are taken as local times; time zones are
+ignored. readCSVGroups reads such a file with one more column, saying whose
+events each row's are, and returns each person's events separately.
+
+An EventIndex is a centered interval tree, so finding the events that
+overlap a span of dates takes time proportional to the logarithm of the
+number of events, plus the number found, however long the events are.
+"""
+
+import csv
+import re
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from gen_calendar import dayNumber, toDatetime
+
+# One event: |summary| is its title, |start| and |end| are datetimes, with
+# |end| exclusive, as in iCalendar. An event with no duration has |end|
+# equal to |start|. |allDay| is true if the event was given as whole days.
+class Event(object):
+    def __init__(self, summary, start, end, allDay=False):
+        self.summary = summary
+        self.start = start
+        self.end = end
+        self.allDay = allDay
+
+    def __repr__(self):
+        return 'Event(%r, %r, %r, allDay=%r)' % (self.summary, self.start, self.end, self.allDay)
+
+# Return the events in the file |filename|, a list of Event objects,
+# choosing the format from the file's extension.
+def readEventFile(filename):
+    if filename.lower().endswith('.csv'):
+        with open(filename, 'rb') as f:
+            return readCSV(f)
+    with open(filename, 'rb') as f:
+        return readICS(f)
+
+# Return the unfolded content lines of the iCalendar file |f|: iCalendar
+# continues long lines onto following lines that begin with a space or tab.
+def unfoldLines(f):
+    lines = []
+    for line in f:
+        line = line.rstrip('\r\n')
+        if line[:1] in (' ', '\t') and lines:
+            lines[-1] += line[1:]
+        elif line:
+            lines.append(line)
+    return lines
+
+# Return the iCalendar DATE or DATE-TIME |value| as a date or datetime.
+def parseICSDate(value):
+    value = value.rstrip('Z')
+    if 'T' in value:
+        return datetime.strptime(value[:15], '%Y%m%dT%H%M%S')
+    return datetime.strptime(value[:8], '%Y%m%d').date()
+
+# Return the iCalendar DURATION |value| as a timedelta.
+def parseDuration(value):
+    match = re.match(r'([-+])?P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$',
+                     value)
+    if not match:
+        raise ValueError("bad duration: %r" % (value,))
+    (sign, weeks, days, hours, minutes, seconds) = match.groups()
+    duration = timedelta(weeks=int(weeks or 0), days=int(days or 0), hours=int(hours or 0),
+                         minutes=int(minutes or 0), seconds=int(seconds or 0))
+    return -duration if sign == '-' else duration
+
+def unescapeText(value):
+    return re.sub(r'\\(.)', lambda m: '\n' if m.group(1) in 'nN' else m.group(1),
+                  value.decode('utf-8', 'replace'))
+
+# Return the events in the iCalendar file |f|, skipping any without a start.
+def readICS(f):
+    events = []
+    properties = None
+    for line in unfoldLines(f):
+        (name, colon, value) = line.partition(':')
+        name = name.split(';')[0].upper()
+        if name == 'BEGIN' and value.upper() == 'VEVENT':
+            properties = {}
+        elif name == 'END' and value.upper() == 'VEVENT':
+            if properties is not None and 'DTSTART' in properties:
+                events.append(makeICSEvent(properties))
+            properties = None
+        elif properties is not None:
+            properties.setdefault(name, value)
+    return events
+
+def makeICSEvent(properties):
+    start = parseICSDate(properties['DTSTART'])
+    allDay = not isinstance(start, datetime)
+    if 'DTEND' in properties:
+        end = toDatetime(parseICSDate(properties['DTEND']))
+    elif 'DURATION' in properties:
+        end = toDatetime(start) + parseDuration(properties['DURATION'])
+    else:
+        # A date with no end is one whole day; a time with no end is a
+        # moment.
+        end = toDatetime(start) + timedelta(1 if allDay else 0)
+    start = toDatetime(start)
+    return Event(unescapeText(properties.get('SUMMARY', '')), start, max(start, end), allDay)
+
+# Return |value|, a date as YYYY-MM-DD or MM/DD/YYYY, as a date.
+def parseCSVDate(value):
+    for format in ('%Y-%m-%d', '%m/%d/%Y'):
+        try:
+            return datetime.strptime(value.strip(), format).date()
+        except ValueError:
+            pass
+    raise ValueError("bad date: %r" % (value,))
+
+# Return |value|, a time as HH:MM, HH:MM:SS, or either followed by AM or
+# PM, as a timedelta from midnight.
+def parseCSVTime(value):
+    value = value.strip().upper()
+    for format in ('%H:%M', '%H:%M:%S', '%I:%M %p', '%I:%M:%S %p', '%I:%M%p'):
+        try:
+            t = datetime.strptime(value, format)
+            return timedelta(hours=t.hour, minutes=t.minute, seconds=t.second)
+        except ValueError:
+            pass
+    raise ValueError("bad time: %r" % (value,))
+
+# Return the events in the CSV file |f|. An all-day event's "End Date" is
+# its last day, as calendar programs show it, rather than the day after.
+def readCSV(f):
+    return [csvEvent(row) for row in csvRows(f) if row.get('start date')]
+
+# Return the events in the CSV file |f| grouped by the value of the column
+# |column|, as an OrderedDict from each value to its list of events, in the
+# order the values first appear. Rows whose |column| is empty belong to
+# every group; they are put in the list for the empty string, if there are
+# any.
+def readCSVGroups(f, column):
+    column = column.strip().lower()
+    groups = OrderedDict()
+    for row in csvRows(f):
+        if column not in row:
+            raise ValueError("no %r column" % (column,))
+        events = groups.setdefault(row[column].decode('utf-8', 'replace'), [])
+        if row.get('start date'):
+            events.append(csvEvent(row))
+    return groups
+
+# Yield the rows of the CSV file |f| as dictionaries, with their keys
+# lower-cased and everything stripped of surrounding space.
+def csvRows(f):
+    for row in csv.DictReader(f):
+        yield dict((k.strip().lower(), (v or '').strip()) for (k, v) in row.items() if k)
+
+def csvEvent(row):
+    startDay = parseCSVDate(row['start date'])
+    endDay = parseCSVDate(row['end date']) if row.get('end date') else startDay
+    allDay = (row.get('all day event', '').lower() in ('true', 'yes', '1')
+              or not row.get('start time'))
+    if allDay:
+        (start, end) = (toDatetime(startDay), toDatetime(endDay) + timedelta(1))
+    else:
+        start = toDatetime(startDay) + parseCSVTime(row['start time'])
+        end = toDatetime(endDay) + (parseCSVTime(row['end time']) if row.get('end time')
+                                    else start - toDatetime(startDay))
+    summary = (row.get('subject') or row.get('summary') or '').decode('utf-8', 'replace')
+    return Event(summary, start, max(start, end), allDay)
+
+# A static index of events by the span of time they cover.
+class EventIndex(object):
+    def __init__(self, events):
+        self.size = len(events)
+        self.root = IntervalNode.build([(dayNumber(e.start), dayNumber(e.end), e)
+                                        for e in events])
+
+    def __len__(self):
+        return self.size
+
+    # Yield the events that overlap the span from |start| up to |end|,
+    # dates or datetimes, in no particular order. An event with no
+    # duration overlaps the span if it falls within it.
+    def overlapping(self, start, end):
+        (a, b) = (dayNumber(start), dayNumber(end))
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+            if b <= node.center:
+                # Every interval here contains the center, so it overlaps
+                # the span if it starts before the span ends.
+                for (s, e, event) in node.byStart:
+                    if s >= b:
+                        break
+                    yield event
+                stack.append(node.left)
+            elif a > node.center:
+                # Similarly, it overlaps if it ends after the span starts.
+                for (s, e, event) in node.byEnd:
+                    if e <= a:
+                        break
+                    yield event
+                stack.append(node.right)
+            else:
+                # Everything here overlaps, except intervals that end just
+                # as the span starts.
+                for (s, e, event) in node.byStart:
+                    if e > a or s >= a:
+                        yield event
+                stack.append(node.left)
+                stack.append(node.right)
+
+# A node of an EventIndex's interval tree. It holds the intervals that
+# contain |center|, sorted by start and by end (descending); |left| and
+# |right| hold those wholly before and after it.
+class IntervalNode(object):
+    def __init__(self, center, here, left, right):
+        self.center = center
+        self.byStart = sorted(here, key=lambda i: i[0])
+        self.byEnd = sorted(here, key=lambda i: i[1], reverse=True)
+        self.left = left
+        self.right = right
+
+    # Build a tree from a list of (start, end, event) tuples, returning its
+    # root, or None if the list is empty.
+    @classmethod
+    def build(cls, intervals):
+        if not intervals:
+            return None
+        # The median start: everything starting before it is left of it,
+        # or contains it.
+        center = sorted(s for (s, e, event) in intervals)[len(intervals) / 2]
+        (left, here, right) = ([], [], [])
+        for interval in intervals:
+            (s, e, event) = interval
+            if e < center or e == center and s < center:
+                left.append(interval)
+            elif s > center:
+                right.append(interval)
+            else:
+                here.append(interval)
+        return cls(center, here, cls.build(left), cls.build(right))
@@ -0,0 +1,124 @@
+"""A size-bounded, content-addressed cache of calendar fragments on disk.
+
+Calendar can keep each month's geometry (background sections, label paths
+and day lines) in a FragmentCache, keyed by a hash of everything that
+determines it: the spiral's parameters, the month, and for day lines, the
+latitude. Re-rendering with a shifted start or end date then recomputes
+only the months whose inputs changed.
+
+Several processes may share one cache directory. Entries are written to a
+temporary file and renamed into place, so readers never see a partial
+entry, and every filesystem operation tolerates another process having
+evicted the file first.
+"""
+
+import cPickle as pickle
+import errno
+import hashlib
+import os
+import tempfile
+import time
+
+# For each cache directory this process has checked the size of, an
+# estimate of how many bytes it has added since. A cache may have been left
+# over its limit by an earlier run, so each process checks once, on its
+# first put; after that, only adding a tenth of the limit prompts another
+# check. batch_render makes a FragmentCache for every job, so this is kept
+# per process rather than per instance.
+addedSinceCheck = {}
+
+class FragmentCache(object):
+    # Keep the cache in |directory|, creating it if necessary, and hold it
+    # to roughly |maxBytes| bytes by evicting the least recently used
+    # entries.
+    def __init__(self, directory, maxBytes=100 * 1024 * 1024):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        makeDirectories(directory)
+
+    # Return the file holding the entry for |key|.
+    def fileFor(self, key):
+        digest = hashlib.sha1(repr(key)).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest[2:])
+
+    # Return the value stored for |key|, or None if there isn't one.
+    def get(self, key):
+        filename = self.fileFor(key)
+        try:
+            with open(filename, 'rb') as f:
+                (storedKey, value) = pickle.load(f)
+        except (IOError, OSError, EOFError, ValueError, pickle.UnpicklingError):
+            return None
+        if storedKey != key:
+            return None
+        # Mark the entry as recently used.
+        try:
+            os.utime(filename, None)
+        except OSError:
+            pass
+        return value
+
+    def put(self, key, value):
+        filename = self.fileFor(key)
+        directory = os.path.dirname(filename)
+        makeDirectories(directory)
+        (fd, temporary) = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((key, value), f, pickle.HIGHEST_PROTOCOL)
+                size = f.tell()
+            os.rename(temporary, filename)
+        except:
+            removeQuietly(temporary)
+            raise
+
+        key = os.path.abspath(self.directory)
+        added = addedSinceCheck.get(key)
+        if added is None or added + size > self.maxBytes / 10:
+            self.evict()
+        else:
+            addedSinceCheck[key] = added + size
+
+    # Delete the least recently used entries until the cache is under 90%
+    # of its limit.
+    def evict(self):
+        addedSinceCheck[os.path.abspath(self.directory)] = 0
+        entries = []
+        total = 0
+        for (directory, subdirectories, files) in os.walk(self.directory):
+            for name in files:
+                filename = os.path.join(directory, name)
+                try:
+                    info = os.stat(filename)
+                except OSError:
+                    continue
+                # Leave other processes' entries-in-progress alone, unless
+                # they have clearly been abandoned.
+                if name.startswith('.tmp-'):
+                    if info.st_mtime < time.time() - 60 * 60:
+                        removeQuietly(filename)
+                    continue
+                entries.append((info.st_mtime, info.st_size, filename))
+                total += info.st_size
+        if total <= self.maxBytes:
+            return
+        entries.sort()
+        target = self.maxBytes * 9 / 10
+        for (mtime, size, filename) in entries:
+            if total <= target:
+                break
+            removeQuietly(filename)
+            total -= size
+
+def makeDirectories(directory):
+    try:
+        os.makedirs(directory)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+def removeQuietly(filename):
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
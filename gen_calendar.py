@@ -1,8 +1,24 @@
+import codecs
+import gzip
+import itertools
 import math
+import re
+import struct
 import sys
 import xml.dom
+from StringIO import StringIO
+from array import array
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import date, datetime, timedelta
 
+# NumPy is only needed for the batched coordinate methods (toXYs and
+# friends); the ordinary one-point-at-a-time path works without it.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 # Proportion p of the way from x1 to x2, where p=0 yields x1, and p=1 yields x2.
 def interp(x1, x2, p): return x1 + p * (x2 - x1)
 
@@ -25,6 +41,19 @@ def toDatetime(d):
 def toFractionalDays(delta):
     return delta.days + float(delta.seconds) / (24 * 60 * 60)
 
+# Raise a helpful error if a batched operation is attempted without NumPy.
+def needNumpy():
+    if numpy is None:
+        raise ImportError("batched coordinate methods require numpy")
+
+# Return the date or datetime |d| as a number of days (with a fractional
+# part, for datetimes) since the start of the proleptic Gregorian calendar.
+def dayNumber(d):
+    n = d.toordinal()
+    if isinstance(d, datetime):
+        n += float(d.hour * 60 * 60 + d.minute * 60 + d.second) / (24 * 60 * 60)
+    return n
+
 def setAttributes(element, **d):
     for (key, value) in d.items():
         element.setAttribute(key, str(value))
@@ -59,15 +88,514 @@ def dayLength(date, latitude):
     m = min(2, max(0, m))
     return math.acos(1 - m) / math.pi
 
+# Solar altitudes, in degrees, for DayLengthTable. dayLength measures until
+# the center of the sun crosses the horizon; civil twilight lasts until it
+# is six degrees below.
+HORIZON = 0
+CIVIL_TWILIGHT = -6
+
+# Day lengths for whole years at once, computed in a single pass over each
+# year (vectorized, if NumPy is available) and cached by (latitude, year).
+# Calling a table like dayLength returns the same values, but repeated
+# renders, and renders of the same span for many latitudes, only pay for
+# the trig once.
+#
+# |altitude| is how high, in degrees, the center of the sun must be for it
+# to count as day: HORIZON gives exactly dayLength's results, while
+# CIVIL_TWILIGHT includes the twilight at either end. The table keeps at
+# most |maxYears| years, dropping the least recently used, so that a
+# long-running process drawing many latitudes doesn't grow without bound.
+class DayLengthTable(object):
+    def __init__(self, altitude=HORIZON, maxYears=1000):
+        self.altitude = altitude
+        self.maxYears = maxYears
+        self.years = OrderedDict()      # (latitude, year) -> list of lengths
+
+    def __call__(self, date, latitude):
+        return self.year(latitude, date.year)[date.timetuple().tm_yday - 1]
+
+    # Return a list of the day lengths at |latitude| for each day from
+    # |start| through |end|, inclusive.
+    def lengths(self, latitude, start, end):
+        result = []
+        for year in xrange(start.year, end.year + 1):
+            table = self.year(latitude, year)
+            first = start.timetuple().tm_yday - 1 if year == start.year else 0
+            last = end.timetuple().tm_yday if year == end.year else len(table)
+            result.extend(table[first:last])
+        return result
+
+    # Return the day lengths at each of |latitudes| for each day from |start|
+    # through |end|, inclusive: one row per latitude, each as lengths would
+    # return it. With NumPy, this is a two-dimensional array computed in a
+    # single pass over the whole grid, so each further latitude costs one
+    # more row rather than another loop over the days; without it, a list
+    # of lists.
+    def grid(self, latitudes, start, end):
+        if numpy is None:
+            return [self.lengths(latitude, start, end) for latitude in latitudes]
+        # Each date's distance from its own year's solstice, as computeYear
+        # counts them.
+        offsets = []
+        for year in xrange(start.year, end.year + 1):
+            jan1 = date(year, 1, 1)
+            fromSolstice = (jan1 - date(year, 12, 21)).days
+            first = start.timetuple().tm_yday - 1 if year == start.year else 0
+            last = (end.timetuple().tm_yday if year == end.year
+                    else (date(year + 1, 1, 1) - jan1).days)
+            offsets.append(numpy.arange(fromSolstice + first, fromSolstice + last))
+        return self.computeGrid([math.radians(l) for l in latitudes],
+                                numpy.concatenate(offsets))
+
+    # Return a two-dimensional array of day lengths, one row for each of
+    # |latitudes|, in radians, and one column for each of |offsets|, an
+    # array of days from the winter solstice.
+    def computeGrid(self, latitudes, offsets):
+        axis = math.radians(23.439)
+        dateAngle = offsets * 2 * math.pi / 365.25
+        declination = -axis * numpy.cos(dateAngle)
+        if self.altitude == HORIZON:
+            tanLatitude = numpy.array([[math.tan(l)] for l in latitudes])
+            m = 1 + tanLatitude * numpy.tan(declination)
+        else:
+            sinLatitude = numpy.array([[math.sin(l)] for l in latitudes])
+            cosLatitude = numpy.array([[math.cos(l)] for l in latitudes])
+            m = 1 - ((math.sin(math.radians(self.altitude)) - sinLatitude * numpy.sin(declination))
+                     / (cosLatitude * numpy.cos(declination)))
+        return numpy.arccos(1 - numpy.clip(m, 0, 2)) / math.pi
+
+    # Return a list of the day lengths at |latitude| for every day of |year|.
+    def year(self, latitude, year):
+        key = (latitude, year)
+        table = self.years.pop(key, None)
+        if table is None:
+            table = self.computeYear(latitude, year)
+            while len(self.years) >= self.maxYears:
+                self.years.popitem(last=False)
+        self.years[key] = table
+        return table
+
+    def computeYear(self, latitude, year):
+        # See dayLength for the formulas; this is the same calculation, in
+        # terms of the sun's declination. The general case uses the hour
+        # angle at which the sun reaches self.altitude. When that is zero,
+        # we take care to produce exactly the values dayLength does.
+        axis = math.radians(23.439)
+        jan1 = date(year, 1, 1)
+        days = (date(year + 1, 1, 1) - jan1).days
+        fromSolstice = (jan1 - date(year, 12, 21)).days
+        latitude = math.radians(latitude)
+
+        if numpy is not None:
+            offsets = numpy.arange(fromSolstice, fromSolstice + days)
+            return self.computeGrid([latitude], offsets)[0].tolist()
+
+        table = []
+        for i in xrange(fromSolstice, fromSolstice + days):
+            declination = -axis * math.cos(i * 2 * math.pi / 365.25)
+            if self.altitude == HORIZON:
+                m = 1 + math.tan(latitude) * math.tan(declination)
+            else:
+                m = 1 - ((math.sin(math.radians(self.altitude)) - math.sin(latitude) * math.sin(declination))
+                         / (math.cos(latitude) * math.cos(declination)))
+            m = min(2, max(0, m))
+            table.append(math.acos(1 - m) / math.pi)
+        return table
+
+# The table Calendar uses unless told otherwise; shared, so that every
+# calendar drawn in this process benefits from its cache.
+defaultDayLengths = DayLengthTable()
+
+# A buffer of SVG path commands. Commands are recorded as numbers and only
+# formatted, all at once, when the path is converted to a string, so
+# building a long path takes time proportional to its length.
+#
+# The commands are kept in two typed arrays: |codes| holds each command's
+# index in |letters|, and |coords| all their arguments, one after another.
+# This takes a fraction of the memory of a list of tuples, and the same
+# geometry can be written as SVG in any OutputProfile, drawn by pdf_backend,
+# or stored with toBytes, without being computed again.
+#
+# Spiral and CircularBand's path methods each take an optional PathBuilder
+# to append to, creating a new one if none is given, and return it.
+# SVGPicture.path accepts a PathBuilder wherever it accepts a string.
+class PathBuilder(object):
+    __slots__ = ('codes', 'coords')
+
+    letters = 'MLACZ'
+
+    formats = {
+        'M': "M %.1f %.1f",
+        'L': "L %.1f %.1f",
+        'A': "A %.1f %.1f %g %d %d %.1f %.1f",
+        'C': "C %.1f %.1f %.1f %.1f %.1f %.1f",
+        'Z': "Z",
+    }
+
+    # The number of arguments each command takes.
+    arity = { 'M': 2, 'L': 2, 'A': 7, 'C': 6, 'Z': 0 }
+
+    def __init__(self):
+        self.codes = array('B')
+        self.coords = array('d')
+
+    def moveTo(self, (x, y)):
+        self.codes.append(0)
+        self.coords.extend((x, y))
+
+    def lineTo(self, (x, y)):
+        self.codes.append(1)
+        self.coords.extend((x, y))
+
+    # A circular arc of radius |r| to (x, y), clockwise if |sweep| is true.
+    def arc(self, r, sweep, (x, y)):
+        self.codes.append(2)
+        self.coords.extend((r, r, 0, 0, 1 if sweep else 0, x, y))
+
+    # A cubic Bezier curve to (x, y), with control points (x1, y1) and
+    # (x2, y2).
+    def curveTo(self, (x1, y1), (x2, y2), (x, y)):
+        self.codes.append(3)
+        self.coords.extend((x1, y1, x2, y2, x, y))
+
+    def close(self):
+        self.codes.append(4)
+
+    # A move to the first of the points (|xs|[i], |ys|[i]) and lines through
+    # the rest, closed if |close| is true. With NumPy, the coordinates are
+    # copied in directly, without a Python loop over the points.
+    def polyline(self, xs, ys, close=False):
+        if not len(xs):
+            return
+        self.codes.append(0)
+        self.codes.extend(array('B', [1]) * (len(xs) - 1))
+        if numpy is not None:
+            self.coords.fromstring(numpy.column_stack((xs, ys)).astype(float).tostring())
+        else:
+            for xy in zip(xs, ys):
+                self.coords.extend(xy)
+        if close:
+            self.close()
+
+    # Append the command |command|, one of |letters|, with the arguments
+    # |args|.
+    def append(self, command, args):
+        self.codes.append(self.letters.index(command))
+        self.coords.extend(args)
+
+    # Return a list of the commands, as (letter, arguments) pairs.
+    @property
+    def commands(self):
+        (letters, arity, coords) = (self.letters, self.arity, self.coords.tolist())
+        commands = []
+        i = 0
+        for code in self.codes:
+            c = letters[code]
+            n = arity[c]
+            commands.append((c, tuple(coords[i:i + n])))
+            i = i + n
+        return commands
+
+    # Return the path as a string, writing each command with |formats|,
+    # which maps letters to format strings as PathBuilder.formats does.
+    def format(self, formats):
+        letters = self.letters
+        return ' '.join([formats[letters[c]] for c in self.codes]) % tuple(self.coords)
+
+    def __str__(self):
+        return self.format(self.formats)
+
+    # Return the path as a string of bytes, all little-endian, whatever this
+    # machine's byte order, so that caches can be shared between machines.
+    # fromBytes turns it back into a PathBuilder.
+    def toBytes(self):
+        coords = self.coords
+        if sys.byteorder != 'little':
+            coords = array('d', coords)
+            coords.byteswap()
+        return struct.pack('<I', len(self.codes)) + self.codes.tostring() + coords.tostring()
+
+    @classmethod
+    def fromBytes(cls, data):
+        (n,) = struct.unpack_from('<I', data)
+        path = cls()
+        path.codes.fromstring(data[4:4 + n])
+        path.coords.fromstring(data[4 + n:])
+        if sys.byteorder != 'little':
+            path.coords.byteswap()
+        return path
+
+    # Parse the SVG path data |d|, returning a PathBuilder holding the same
+    # path in absolute commands. We understand the commands PathBuilder
+    # produces, in absolute or relative form, and the horizontal and
+    # vertical line shorthands OutputProfile may use for them.
+    @classmethod
+    def fromString(cls, d):
+        path = cls()
+        tokens = re.findall(r'[A-Za-z]|[-+]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][-+]?[0-9]+)?', d)
+        (x, y) = start = (0, 0)
+        i = 0
+        command = None
+        while i < len(tokens):
+            if tokens[i].isalpha():
+                command = tokens[i]
+                i = i + 1
+            elif command is None:
+                raise ValueError("path data doesn't start with a command: %r" % (d,))
+            upper = command.upper()
+            if upper in 'HV':
+                if i >= len(tokens) or tokens[i].isalpha():
+                    raise ValueError("too few arguments to %r in %r" % (command, d))
+                v = float(tokens[i])
+                i = i + 1
+                if upper == 'H':
+                    x = v + (x if command.islower() else 0)
+                else:
+                    y = v + (y if command.islower() else 0)
+                path.lineTo((x, y))
+                continue
+            if upper not in cls.arity:
+                raise ValueError("unsupported path command %r in %r" % (command, d))
+            n = cls.arity[upper]
+            args = [float(t) for t in tokens[i:i + n]]
+            if len(args) < n:
+                raise ValueError("too few arguments to %r in %r" % (command, d))
+            i = i + n
+            if command.islower():
+                # Points are relative to the current point. (Of an arc's
+                # arguments, only the last two are a point.)
+                for j in xrange(n - 2 if upper == 'A' else 0, n, 2):
+                    args[j] += x
+                    args[j + 1] += y
+            if upper == 'Z':
+                path.close()
+                (x, y) = start
+            else:
+                path.append(upper, args)
+                (x, y) = args[-2:]
+                if upper == 'M':
+                    start = (x, y)
+                    # Further coordinate pairs are implicit line-tos.
+                    command = 'l' if command.islower() else 'L'
+        return path
+
+# How to write out SVG: the number of digits after the decimal point in
+# path coordinates (|precision|), whether to write paths with relative and
+# shorthand commands and as few characters as possible (|relative|),
+# whether to indent the XML (|pretty|), and whether to gzip the whole file,
+# as for an .svgz file (|compress|).
+#
+# The default profile writes what this script always has. A compact
+# profile's paths still begin with an absolute move, so path data strings
+# can be concatenated into a compound path as before.
+class OutputProfile(object):
+    def __init__(self, precision=1, relative=False, pretty=True, compress=False):
+        self.precision = precision
+        self.relative = relative
+        self.pretty = pretty
+        self.compress = compress
+        self.formats = dict((c, f.replace('%.1f', '%%.%df' % precision))
+                            for (c, f) in PathBuilder.formats.items())
+
+    # Return a tuple of everything that affects path data, for use in cache
+    # keys.
+    def parameters(self):
+        return (self.precision, self.relative)
+
+    # Return the |addindent| and |newl| arguments for writexml.
+    def indentation(self):
+        return ('  ', '\n') if self.pretty else ('', '')
+
+    # Return |path| as a string of path data. If it is already a string,
+    # return it unchanged.
+    def pathData(self, path):
+        if not isinstance(path, PathBuilder):
+            return path
+        if self.relative:
+            return self.relativePathData(path)
+        return path.format(self.formats)
+
+    # Write |v| with our precision, but no trailing zeros, and no zero
+    # before the decimal point.
+    def number(self, v):
+        s = '%.*f' % (self.precision, v)
+        if '.' in s:
+            s = s.rstrip('0').rstrip('.')
+        if s.startswith('0.'):
+            s = s[1:]
+        elif s.startswith('-0.'):
+            s = '-' + s[2:]
+        return '0' if s == '-0' else s
+
+    # Return |path| as compact path data. We round each absolute point
+    # before taking differences, so rounding errors don't accumulate along
+    # the path.
+    def relativePathData(self, path):
+        p = self.precision
+        out = []
+        (previous, previousNumber) = (None, None)       # last command and number written
+        current = start = None
+        for (c, args) in path.commands:
+            if c == 'Z':
+                (letter, numbers) = ('z', [])
+                current = start
+            else:
+                (x, y) = (round(args[-2], p), round(args[-1], p))
+                if current is None:
+                    (letter, numbers) = (c, args)
+                else:
+                    (cx, cy) = current
+                    (dx, dy) = (round(x - cx, p), round(y - cy, p))
+                    if c == 'L' and dy == 0:
+                        (letter, numbers) = ('h', [dx])
+                    elif c == 'L' and dx == 0:
+                        (letter, numbers) = ('v', [dy])
+                    elif c == 'A':
+                        (letter, numbers) = ('a', args[:5] + (dx, dy))
+                    elif c == 'C':
+                        (letter, numbers) = ('c', (round(args[0], p) - cx, round(args[1], p) - cy,
+                                                   round(args[2], p) - cx, round(args[3], p) - cy,
+                                                   dx, dy))
+                    else:
+                        (letter, numbers) = (c.lower(), (dx, dy))
+                current = (x, y)
+                if c == 'M':
+                    start = current
+
+            # A repeated command can go without its letter.
+            if letter != previous or letter == 'z':
+                out.append(letter)
+                previousNumber = None
+            for v in numbers:
+                n = self.number(v)
+                if previousNumber is not None and not (n[0] == '-' or
+                                                       n[0] == '.' and '.' in previousNumber):
+                    out.append(' ')
+                out.append(n)
+                previousNumber = n
+            # Pairs following a move are lines.
+            previous = {'M': 'L', 'm': 'l'}.get(letter, letter)
+        return ''.join(out)
+
+    # A context manager yielding a file to write the document to, in place
+    # of |out|. If we're compressing, the document is gzipped onto |out|,
+    # which should be a binary file, and encoded as UTF-8 on the way.
+    @contextmanager
+    def output(self, out):
+        if not self.compress:
+            yield out
+            return
+        # A fixed timestamp makes the output depend only on the drawing.
+        gz = gzip.GzipFile(filename='', mode='wb', fileobj=out, mtime=0)
+        try:
+            yield codecs.getwriter('utf-8')(gz)
+        finally:
+            gz.close()
+
+defaultProfile = OutputProfile()
+
+# Return a list of cubic Bezier curves, each a tuple (x1, y1, x2, y2, x, y)
+# of control and end points, approximating the SVG elliptical arc from
+# (x0, y0) to (x, y) with the given radii, x-axis rotation (in degrees),
+# and large-arc and sweep flags. Each curve spans at most a quarter turn.
+def arcToCurves(x0, y0, rx, ry, rotation, large, sweep, x, y):
+    # This follows the SVG specification's appendix on implementing arcs:
+    # convert to center parameterization, then approximate each piece.
+    if (x0, y0) == (x, y):
+        return []
+    if rx == 0 or ry == 0:
+        return [(x0, y0, x, y, x, y)]
+    (rx, ry) = (abs(rx), abs(ry))
+    phi = math.radians(rotation)
+    (cosPhi, sinPhi) = (math.cos(phi), math.sin(phi))
+    dx2 = (x0 - x) / 2.0
+    dy2 = (y0 - y) / 2.0
+    x1p = cosPhi * dx2 + sinPhi * dy2
+    y1p = -sinPhi * dx2 + cosPhi * dy2
+
+    # Scale up radii that are too small to span the endpoints.
+    scale = (x1p * x1p) / (rx * rx) + (y1p * y1p) / (ry * ry)
+    if scale > 1:
+        rx = rx * math.sqrt(scale)
+        ry = ry * math.sqrt(scale)
+
+    numerator = rx*rx*ry*ry - rx*rx*y1p*y1p - ry*ry*x1p*x1p
+    denominator = rx*rx*y1p*y1p + ry*ry*x1p*x1p
+    coefficient = math.sqrt(max(0, numerator / denominator))
+    if bool(large) == bool(sweep):
+        coefficient = -coefficient
+    cxp = coefficient * rx * y1p / ry
+    cyp = -coefficient * ry * x1p / rx
+    cx = cosPhi * cxp - sinPhi * cyp + (x0 + x) / 2.0
+    cy = sinPhi * cxp + cosPhi * cyp + (y0 + y) / 2.0
+
+    def angle(ux, uy, vx, vy):
+        return math.atan2(ux * vy - uy * vx, ux * vx + uy * vy)
+    theta = angle(1, 0, (x1p - cxp) / rx, (y1p - cyp) / ry)
+    delta = angle((x1p - cxp) / rx, (y1p - cyp) / ry, (-x1p - cxp) / rx, (-y1p - cyp) / ry)
+    if sweep and delta < 0:
+        delta = delta + 2 * math.pi
+    elif not sweep and delta > 0:
+        delta = delta - 2 * math.pi
+
+    def point(t):
+        (ex, ey) = (rx * math.cos(t), ry * math.sin(t))
+        return (cosPhi * ex - sinPhi * ey + cx, sinPhi * ex + cosPhi * ey + cy)
+    def derivative(t):
+        (ex, ey) = (-rx * math.sin(t), ry * math.cos(t))
+        return (cosPhi * ex - sinPhi * ey, sinPhi * ex + cosPhi * ey)
+
+    pieces = max(1, int(math.ceil(abs(delta) / (math.pi / 2) - 1e-9)))
+    step = delta / pieces
+    k = 4.0 / 3 * math.tan(step / 4)
+    curves = []
+    for i in xrange(pieces):
+        (t1, t2) = (theta + i * step, theta + (i + 1) * step)
+        (p1x, p1y) = point(t1)
+        (p2x, p2y) = (x, y) if i == pieces - 1 else point(t2)
+        (d1x, d1y) = derivative(t1)
+        (d2x, d2y) = derivative(t2)
+        curves.append((p1x + k * d1x, p1y + k * d1y, p2x - k * d2x, p2y - k * d2y, p2x, p2y))
+    return curves
+
+# Return |path|, or a fresh PathBuilder if |path| is None.
+def pathOrNew(path):
+    return PathBuilder() if path is None else path
+
+# Append |child| to |parent|, unless |parent| is None. Return |child|.
+#
+# The element-building methods below take an optional |parent| and attach
+# their result to it before filling it in, so that a StreamingSVGPicture
+# can write each element out as soon as it is complete.
+def adopt(parent, child):
+    if parent is not None:
+        parent.appendChild(child)
+    return child
+
+SVG_PUBLIC_ID = '-//W3C//DTD SVG 1.1//EN'
+SVG_SYSTEM_ID = 'http://www.w3.org/Graphics/SVG/1.1/DTD/svg11.dtd'
+
 # Bookkeeping helpers for an SVG XML document. self.root is an xml.dom
-# document element in the document self.doc.
+# document element in the document self.doc. Path data is written as
+# |profile|, an OutputProfile, says.
+#
+# If |geometry| is true, each path element made from a PathBuilder keeps it
+# as the element's |geometry| attribute, for serializers like pdf_backend
+# that would rather not parse the path data back.
 class SVGPicture(object):
-    def __init__(self, (realWidth, realHeight), pixelWidthHeight):
+    def __init__(self, realWidthHeight, pixelWidthHeight, profile=None, geometry=False):
+        self.profile = profile or defaultProfile
+        self.geometry = geometry
         impl = xml.dom.getDOMImplementation()
-        doctype = impl.createDocumentType('svg', '-//W3C//DTD SVG 1.1//EN',
-                                          'http://www.w3.org/Graphics/SVG/1.1/DTD/svg11.dtd')
+        doctype = impl.createDocumentType('svg', SVG_PUBLIC_ID, SVG_SYSTEM_ID)
         self.doc = impl.createDocument('http://www.w3.org/2000/svg', 'svg', doctype)
         self.root = self.doc.documentElement
+        self.initRoot(realWidthHeight, pixelWidthHeight)
+
+    def initRoot(self, (realWidth, realHeight), pixelWidthHeight):
+        # Remember the sizes, for making other pictures the same size.
+        self.realWidthHeight = (realWidth, realHeight)
+        self.pixelWidthHeight = pixelWidthHeight
         self.root.setAttribute('xmlns', 'http://www.w3.org/2000/svg')
         self.root.setAttribute('xmlns:xlink', 'http://www.w3.org/1999/xlink')
         self.root.setAttribute('version', '1.1')
@@ -87,8 +615,20 @@ class SVGPicture(object):
         return setAttributes(self.doc.createElement('g'), **attributes)
 
     def path(self, d, **attributes):
-        attributes['d'] = d
-        return setAttributes(self.doc.createElement('path'), **attributes)
+        attributes['d'] = self.profile.pathData(d)
+        p = setAttributes(self.doc.createElement('path'), **attributes)
+        if self.geometry and isinstance(d, PathBuilder):
+            p.geometry = d
+        return p
+
+    # Return the PathBuilder |path| as path data for this picture.
+    def pathData(self, path):
+        return self.profile.pathData(path)
+
+    # Write the document to |out|, as our profile says.
+    def write(self, out):
+        (addindent, newl) = self.profile.indentation()
+        self.doc.writexml(out, addindent=addindent, newl=newl)
 
     def textPath(self, content, **attributes):
         tp = self.doc.createElement('textPath')
@@ -106,6 +646,195 @@ class SVGPicture(object):
     def defs(self):
         return self.doc.createElement('defs')
 
+    def animate(self, **attributes):
+        return setAttributes(self.doc.createElement('animate'), **attributes)
+
+    # A 'use' element, placing another copy of the element |href| refers to.
+    def use(self, href, **attributes):
+        u = self.doc.createElement('use')
+        u.setAttribute('xlink:href', href)
+        return setAttributes(u, **attributes)
+
+# The streaming counterpart of xml.dom's Text and Element nodes. These
+# support just the subset of the DOM that SVGPicture and its users need.
+class StreamText(object):
+    nodeType = xml.dom.Node.TEXT_NODE
+
+    def __init__(self, data):
+        self.data = data
+        self.parentNode = None
+
+class StreamElement(object):
+    nodeType = xml.dom.Node.ELEMENT_NODE
+
+    def __init__(self, doc, tagName):
+        self.doc = doc
+        self.tagName = tagName
+        self.attributes = {}
+        self.childNodes = []
+        self.parentNode = None
+        self.depth = None               # set once our start tag is written
+        self.written = False
+
+    def setAttribute(self, name, value):
+        if self.written or self.depth is not None:
+            raise ValueError("can't set attribute '%s' on <%s>: it has already been written"
+                             % (name, self.tagName))
+        self.attributes[name] = value
+
+    def appendChild(self, child):
+        return self.doc.append(self, child)
+
+    @property
+    def lastChild(self):
+        return self.childNodes[-1] if self.childNodes else None
+
+# A write-as-you-go stand-in for an xml.dom Document. Elements attached
+# beneath the document element are written to |out| as soon as we know
+# they are complete: when a later sibling is appended, or the document is
+# closed. Written elements are dropped, so memory use depends on the depth
+# of the tree, not its size.
+#
+# The output is the same, byte for byte, as xml.dom's writexml with the
+# same |addindent| and |newl| arguments would produce, provided that:
+#
+# - attributes are set before any children are appended, and
+#
+# - elements are attached to their parents before their children are, and
+#   an element is complete by the time a later sibling is appended.
+#
+# Subtrees built before being attached work fine; they just don't stream.
+class StreamDocument(object):
+    def __init__(self, out, tagName, publicId, systemId, addindent='', newl=''):
+        self.out = out
+        self.addindent = addindent
+        self.newl = newl
+        out.write('<?xml version="1.0" ?>' + newl)
+        out.write("<!DOCTYPE %s%s  PUBLIC '%s'%s  '%s'>%s"
+                  % (tagName, newl, publicId, newl, systemId, newl))
+        self.documentElement = self.createElement(tagName)
+
+        # Elements whose start tags have been written but whose end tags
+        # have not, outermost first.
+        self.open = []
+
+    def createElement(self, tagName):
+        return StreamElement(self, tagName)
+
+    def createTextNode(self, data):
+        return StreamText(data)
+
+    def append(self, parent, child):
+        if parent.written:
+            raise ValueError("can't append to <%s>: it has already been written"
+                             % (parent.tagName,))
+        child.parentNode = parent
+        if parent.childNodes and self.streamable(parent):
+            self.startElement(parent)
+            indent = (parent.depth + 1) * self.addindent
+            for c in parent.childNodes:
+                self.writeNode(c, indent)
+            del parent.childNodes[:]
+        parent.childNodes.append(child)
+        return child
+
+    # True if |element| is at the frontier of what we've written: it is
+    # open, or it's the document element, or it's the last child of an
+    # element at the frontier.
+    def streamable(self, element):
+        if element.depth is not None or element is self.documentElement:
+            return True
+        parent = element.parentNode
+        return (parent is not None and parent.childNodes[-1] is element
+                and self.streamable(parent))
+
+    # Write |element|'s start tag, first starting its ancestors, writing
+    # its earlier siblings, and closing any open elements that are not its
+    # ancestors.
+    def startElement(self, element):
+        if element.depth is not None:
+            while self.open[-1] is not element:
+                self.endElement()
+            return
+        parent = element.parentNode
+        if element is not self.documentElement:
+            self.startElement(parent)
+            indent = (parent.depth + 1) * self.addindent
+            for c in parent.childNodes[:-1]:
+                self.writeNode(c, indent)
+            del parent.childNodes[:-1]
+        element.depth = len(self.open)
+        self.writeStartTag(element, element.depth * self.addindent)
+        self.out.write('>' + self.newl)
+        self.open.append(element)
+
+    # Write out the innermost open element's remaining children and its
+    # end tag.
+    def endElement(self):
+        element = self.open.pop()
+        indent = element.depth * self.addindent
+        for c in element.childNodes:
+            self.writeNode(c, indent + self.addindent)
+        del element.childNodes[:]
+        self.out.write('%s</%s>%s' % (indent, element.tagName, self.newl))
+        element.written = True
+        if element.parentNode is not None:
+            element.parentNode.childNodes.remove(element)
+
+    def writeStartTag(self, element, indent):
+        self.out.write(indent + '<' + element.tagName)
+        for name in sorted(element.attributes):
+            self.out.write(' %s="' % name)
+            self.writeData(element.attributes[name])
+            self.out.write('"')
+
+    # Write the complete, not-yet-started node |node|, as writexml would.
+    def writeNode(self, node, indent):
+        if node.nodeType == xml.dom.Node.TEXT_NODE:
+            self.writeData('%s%s%s' % (indent, node.data, self.newl))
+            return
+        self.writeStartTag(node, indent)
+        children = node.childNodes
+        if not children:
+            self.out.write('/>' + self.newl)
+        elif len(children) == 1 and children[0].nodeType == xml.dom.Node.TEXT_NODE:
+            self.out.write('>')
+            self.writeData(children[0].data)
+            self.out.write('</%s>%s' % (node.tagName, self.newl))
+        else:
+            self.out.write('>' + self.newl)
+            for c in children:
+                self.writeNode(c, indent + self.addindent)
+            self.out.write('%s</%s>%s' % (indent, node.tagName, self.newl))
+        node.written = True
+
+    def writeData(self, data):
+        if data:
+            self.out.write(data.replace("&", "&amp;").replace("<", "&lt;")
+                           .replace("\"", "&quot;").replace(">", "&gt;"))
+
+    # Write everything that's left, finishing the document.
+    def close(self):
+        if self.documentElement.depth is None:
+            self.writeNode(self.documentElement, '')
+        while self.open:
+            self.endElement()
+
+# An SVGPicture that writes its elements to |out| as they are completed,
+# rather than building the whole document in memory. See StreamDocument
+# for the rules callers must follow. Call close() when done.
+class StreamingSVGPicture(SVGPicture):
+    def __init__(self, out, realWidthHeight, pixelWidthHeight, profile=None):
+        self.profile = profile or defaultProfile
+        self.geometry = False
+        (addindent, newl) = self.profile.indentation()
+        self.doc = StreamDocument(out, 'svg', SVG_PUBLIC_ID, SVG_SYSTEM_ID, addindent, newl)
+        self.root = self.doc.documentElement
+        self.initRoot(realWidthHeight, pixelWidthHeight)
+
+    def close(self):
+        self.doc.close()
+
 # A coordinate transformation, taking dates and radii to cartesian points on a spiral.
 #
 # In the domain (input) coordinate system:
@@ -140,8 +869,17 @@ class SVGPicture(object):
 # This class provides methods for computing path commands, but we stay out
 # of the business of actually constructing nodes. It does not use any
 # SVGPicture object. (Is that a meaningful division of labor?)
+#
+# If |tolerance| is given, segment draws spiral segments as cubic Bezier
+# curves that follow the true spiral to within |tolerance| pixels, using as
+# few curves as it can. Otherwise, it uses a single circular arc, which is
+# only a good approximation for short segments.
 class Spiral(object):
-    def __init__(self, center, topDate, nextTopDate, topRadius, nextTopRadius, thickness):
+    __slots__ = ('center', 'top', 'nextTop', 'circumDays', 'topRadius', 'nextTopRadius',
+                 'thickness', 'tolerance')
+
+    def __init__(self, center, topDate, nextTopDate, topRadius, nextTopRadius, thickness,
+                 tolerance=None):
         self.center = center
         self.top = topDate
         self.nextTop = nextTopDate
@@ -149,79 +887,312 @@ class Spiral(object):
         self.topRadius = topRadius
         self.nextTopRadius = nextTopRadius
         self.thickness = thickness
+        self.tolerance = tolerance
+
+    # Return a tuple of everything that determines where this spiral puts
+    # things, for use in cache keys.
+    def parameters(self):
+        return (self.center, self.top, self.nextTop, self.topRadius, self.nextTopRadius,
+                self.thickness, self.tolerance)
 
     # Return the angle corresponding to |date|, in revolutions (1 means one
     # full circuit around the spiral).
     def dateToProportion(self, date):
         return toFractionalDays(toDatetime(date) - toDatetime(self.top)) / self.circumDays
 
+    # Return the distance from the center of the point at proportion |p|
+    # (as returned by dateToProportion) and |radius|.
+    def proportionRadius(self, p, radius):
+        return interp(self.topRadius, self.nextTopRadius, p) + interp(0, self.thickness, radius)
+
     # Return the distance from the center of the point |date|, |radius|.
     def pixelRadius(self, date, radius):
-        p = self.dateToProportion(date)
-        return interp(self.topRadius, self.nextTopRadius, p) + interp(0, self.thickness, radius)
+        return self.proportionRadius(self.dateToProportion(date), radius)
 
     # Return the (x,y) coordinates of the point corresponding to (|date|, |radius|).
     def toXY(self, date, radius):
         (cx, cy) = self.center
         p = self.dateToProportion(date)
-        pixelRadius = self.pixelRadius(date, radius)
+        pixelRadius = self.proportionRadius(p, radius)
         return (cx + math.sin(p * 2*math.pi) * pixelRadius,
                 cy - math.cos(p * 2*math.pi) * pixelRadius)
 
-    # A path command to move to |date|, |radius|. The command has no
-    # trailing or leading spaces.
-    def moveTo(self, date, radius):
-        return "M %.1f %.1f" % self.toXY(date, radius)
-
-    # A path command to draw a straight line from the current position to
-    # |date|, |radius|. The command starts with a space.
-    def lineTo(self, date, radius):
-        return " L %.1f %.1f" % self.toXY(date, radius)
-
-    # A path command for a spiral segment from date1 to date2, at radius r.
-    # This assumes that the current path position is spiral.toXY(date1, r).
-    # The command begins with a space.
-    def segment(self, date1, date2, r):
-        # Return a circle segment, starting and ending at the right place,
+    # Batched versions of the above. These take a whole sequence of points
+    # at once and return NumPy arrays, doing the date arithmetic and trig
+    # in one pass rather than one Python-level round trip per point.
+    #
+    # |dates| may be a sequence of date or datetime instances, or a numeric
+    # array of (possibly fractional) day offsets from |topDate|. |radii|
+    # may be a single number or an array that broadcasts against |dates|.
+
+    # Return the offsets of |dates| from |topDate|, in fractional days.
+    def dayOffsets(self, dates):
+        needNumpy()
+        if isinstance(dates, numpy.ndarray):
+            return dates.astype(float)
+        dates = list(dates)
+        if dates and not isinstance(dates[0], date):
+            return numpy.array(dates, dtype=float)
+        # NumPy's own conversion of date objects is much slower than this.
+        return numpy.fromiter((dayNumber(d) for d in dates), float, len(dates)) - dayNumber(self.top)
+
+    def dateToProportions(self, dates):
+        return self.dayOffsets(dates) / self.circumDays
+
+    def proportionRadii(self, p, radii):
+        return (interp(self.topRadius, self.nextTopRadius, p)
+                + interp(0, self.thickness, numpy.asarray(radii, dtype=float)))
+
+    def pixelRadii(self, dates, radii):
+        return self.proportionRadii(self.dateToProportions(dates), radii)
+
+    # Return a pair of arrays (xs, ys), the coordinates of the points
+    # (|dates|[i], |radii|[i]).
+    def toXYs(self, dates, radii):
+        (cx, cy) = self.center
+        p = self.dateToProportions(dates)
+        pixelRadius = self.proportionRadii(p, radii)
+        return (cx + numpy.sin(p * 2*numpy.pi) * pixelRadius,
+                cy - numpy.cos(p * 2*numpy.pi) * pixelRadius)
+
+    # The inverse of toXY. Return (datetime, radius) for the point (x, y),
+    # choosing the turn of the spiral on which the radius falls between |r1|
+    # and |r2|, or return None if there is no such turn.
+    #
+    # The point's angle gives its proportion up to a whole number of turns,
+    # and since pixel radius grows linearly with proportion, the turn is
+    # just the quotient of the remaining distance by the growth per turn.
+    # So each query is a few arithmetic operations, with no search. (When
+    # turns overlap, because |thickness| exceeds the growth per turn, this
+    # picks the one on which the radius is least.)
+    def fromXY(self, x, y, r1=0, r2=1):
+        (cx, cy) = self.center
+        (dx, dy) = (x - cx, cy - y)
+        # How far around the point is, clockwise from the top, from 0 to 1.
+        around = math.atan2(dx, dy) / (2*math.pi) % 1.0
+        growth = self.nextTopRadius - self.topRadius
+        distance = math.hypot(dx, dy) - self.topRadius - r1 * self.thickness
+        turn = 0
+        if growth:
+            q = distance / growth - around
+            turn = math.floor(q) if growth > 0 else math.ceil(q)
+        p = turn + around
+        radius = (distance - p * growth) / self.thickness + r1
+        if not r1 <= radius <= r2:
+            return None
+        return (toDatetime(self.top) + timedelta(p * self.circumDays), radius)
+
+    # A batched fromXY. Return a triple of arrays (offsets, radii, hits):
+    # the day offsets from |topDate| (as dayOffsets takes them) and radii
+    # of the points (|xs|[i], |ys|[i]), and whether each lies between |r1|
+    # and |r2|. Offsets and radii for points that miss are meaningless.
+    def fromXYs(self, xs, ys, r1=0, r2=1):
+        needNumpy()
+        (cx, cy) = self.center
+        (dx, dy) = (numpy.asarray(xs, dtype=float) - cx, cy - numpy.asarray(ys, dtype=float))
+        around = numpy.arctan2(dx, dy) / (2*numpy.pi) % 1.0
+        growth = self.nextTopRadius - self.topRadius
+        distance = numpy.hypot(dx, dy) - self.topRadius - r1 * self.thickness
+        turn = 0
+        if growth:
+            q = distance / growth - around
+            turn = numpy.floor(q) if growth > 0 else numpy.ceil(q)
+        p = turn + around
+        radii = (distance - p * growth) / self.thickness + r1
+        return (p * self.circumDays, radii, (r1 <= radii) & (radii <= r2))
+
+    # Append a command to move to |date|, |radius| to |path|, and return
+    # |path|. As with all the path methods below, |path| is a
+    # PathBuilder; if omitted, we start a new one.
+    def moveTo(self, date, radius, path=None):
+        path = pathOrNew(path)
+        path.moveTo(self.toXY(date, radius))
+        return path
+
+    # Append a command to draw a straight line from the current position
+    # to |date|, |radius|.
+    def lineTo(self, date, radius, path=None):
+        path = pathOrNew(path)
+        path.lineTo(self.toXY(date, radius))
+        return path
+
+    # Append a command for a spiral segment from date1 to date2, at radius
+    # r. This assumes that the current path position is
+    # spiral.toXY(date1, r).
+    def segment(self, date1, date2, r, path=None):
+        path = pathOrNew(path)
+        if self.tolerance is not None:
+            self.curves(self.dateToProportion(date1), self.dateToProportion(date2), r, path)
+            return path
+
+        # Draw a circle segment, starting and ending at the right place,
         # and with a radius halfway between our start and end radii. This
         # is kind of a punt, since spiral segments are not circle segments,
         # but it doesn't look too bad as long as the radius is big enough.
-        # Could we do better with a spline?
         midSegment = date1 + (date2 - date1) / 2
-        rpx = self.pixelRadius(midSegment, r)
-        return (" A %.1f %.1f 0 0 %d %.1f %.1f"
-                % ((rpx, rpx, (1 if date2 > date1 else 0))
-                   + self.toXY(date2, r)))
-
-    # A path command for a section from date d1 to d2, and radius r1 to r2.
-    def section(self, date1, date2, r1, r2):
-        return (self.moveTo(date1, r1)
-                + self.segment(date1, date2, r1)
-                + self.lineTo(date2, r2)
-                + self.segment(date2, date1, r2)
-                + " Z")
-
-    # A path command for a line radiating out from the center at date d,
+        path.arc(self.pixelRadius(midSegment, r), date2 > date1, self.toXY(date2, r))
+        return path
+
+    # The point at proportion |p| and |radius|, and its derivative with
+    # respect to |p|.
+    def pointAndTangent(self, p, radius):
+        (cx, cy) = self.center
+        pixelRadius = self.proportionRadius(p, radius)
+        growth = self.nextTopRadius - self.topRadius
+        (s, c) = (math.sin(p * 2*math.pi), math.cos(p * 2*math.pi))
+        return ((cx + s * pixelRadius, cy - c * pixelRadius),
+                (growth * s + 2*math.pi * pixelRadius * c,
+                 -growth * c + 2*math.pi * pixelRadius * s))
+
+    # Append to |path| cubic Bezier curves following the spiral at |radius|
+    # from proportion |p1| to |p2|, to within self.tolerance pixels.
+    #
+    # Each curve matches the spiral's position and direction at its ends.
+    # The error of such a curve shrinks with the fourth power of its
+    # length, and for a given length, hardly varies along the spiral, so we
+    # estimate the number of equal pieces needed from the error of a trial
+    # division, and then check it.
+    def curves(self, p1, p2, radius, path):
+        n = 1
+        while True:
+            (pieces, error) = self.divide(p1, p2, radius, n)
+            if error <= self.tolerance:
+                break
+            n = max(n + 1, int(math.ceil(n * (error / self.tolerance) ** 0.25)))
+        for (c1, c2, end) in pieces:
+            path.curveTo(c1, c2, end)
+
+    # Split the spiral at |radius| from |p1| to |p2| into |n| equal
+    # pieces, and return a list of (control1, control2, end) for their
+    # curves, along with the greatest distance we found between a curve and
+    # the spiral.
+    def divide(self, p1, p2, radius, n):
+        h = float(p2 - p1) / n
+        pieces = []
+        error = 0
+        (start, startTangent) = self.pointAndTangent(p1, radius)
+        for i in xrange(n):
+            (end, endTangent) = self.pointAndTangent(p1 + (i + 1) * h, radius)
+            c1 = (start[0] + startTangent[0] * h / 3, start[1] + startTangent[1] * h / 3)
+            c2 = (end[0] - endTangent[0] * h / 3, end[1] - endTangent[1] * h / 3)
+            for t in (0.25, 0.5, 0.75):
+                u = 1 - t
+                x = u*u*u*start[0] + 3*u*u*t*c1[0] + 3*u*t*t*c2[0] + t*t*t*end[0]
+                y = u*u*u*start[1] + 3*u*u*t*c1[1] + 3*u*t*t*c2[1] + t*t*t*end[1]
+                ((sx, sy), _) = self.pointAndTangent(p1 + (i + t) * h, radius)
+                error = max(error, math.hypot(x - sx, y - sy))
+            pieces.append((c1, c2, end))
+            (start, startTangent) = (end, endTangent)
+        return (pieces, error)
+
+    # Append commands for a section from date d1 to d2, and radius r1 to r2.
+    def section(self, date1, date2, r1, r2, path=None):
+        path = self.moveTo(date1, r1, path)
+        self.segment(date1, date2, r1, path)
+        self.lineTo(date2, r2, path)
+        self.segment(date2, date1, r2, path)
+        path.close()
+        return path
+
+    # Append commands for a line radiating out from the center at date d,
     # starting at radius r1, and ending at radius r2.
-    def radial(self, d, r1, r2):
-        return self.moveTo(d, r1) + self.lineTo(d, r2)
+    def radial(self, d, r1, r2, path=None):
+        return self.lineTo(d, r2, self.moveTo(d, r1, path))
+
+# The colours of Calendar's comparison bands, in order.
+comparisonColours = ['rgb(220,60,60)', 'rgb(40,110,210)', 'rgb(40,160,70)', 'rgb(160,80,190)']
+
+# Levels of detail for Calendar.
+(DETAIL_OUTLINE, DETAIL_WEEKS, DETAIL_DAYS) = (0, 1, 2)
 
+# |dayLengths| is the DayLengthTable to use for the day lines; by default,
+# defaultDayLengths.
+#
+# If |mergePaths| is true, draw each layer of identically styled shapes (the
+# month backgrounds of each colour, the spiral edges, the weekday lines and
+# the Monday lines) as a single compound path, rather than one element per
+# shape. The picture looks the same, but has far fewer elements for
+# renderers to deal with.
+#
+# |spiralStep| is the length, in days, of the arcs approximating the
+# spiral's edges, unless the spiral has a tolerance, in which case it
+# divides the edges itself.
+#
+# If |cache| is given, it is an object with get(key) and put(key, value)
+# methods, like fragment_cache.FragmentCache, in which to keep each month's
+# geometry from one render to the next. Keys are tuples of dates, numbers
+# and strings; values are lists of strings from PathBuilder.toBytes. get
+# returns None for missing entries.
+#
+# |events|, if given, is an events.EventIndex of events to draw over the
+# month backgrounds.
+#
+# |detail| is how much of the frame to draw: DETAIL_OUTLINE for just the
+# spiral's edges, DETAIL_WEEKS to add the Monday lines, or DETAIL_DAYS (the
+# default) for everything, including each day's line and the Monday dates.
+#
+# |today|, if given, is a date to mark with a heavier line over its day line.
+#
+# |comparisons|, if given, is a list of other latitudes whose daylight to
+# show alongside |latitude|'s: each gets a band along the spiral, as wide
+# each day as the day line would be there, in its own colour from
+# comparisonColours.
 class Calendar(object):
-    def __init__(self, picture, spiral, startDate, endDate, latitude):
+    def __init__(self, picture, spiral, startDate, endDate, latitude, dayLengths=None,
+                 mergePaths=False, spiralStep=10, cache=None, events=None, detail=None,
+                 today=None, comparisons=None):
         self.picture = picture
         self.spiral = spiral
         self.startDate = startDate
         self.endDate = endDate
         self.latitude = latitude
+        self.dayLengths = dayLengths or defaultDayLengths
+        self.mergePaths = mergePaths
+        self.spiralStep = spiralStep
+        self.cache = cache
+        self.events = events
+        self.detail = DETAIL_DAYS if detail is None else detail
+        self.today = today
+        self.comparisons = comparisons or []
         self.nextId = 0
 
-    def element(self):
-        g = self.picture.group()
-        g.appendChild(self.monthSections())
-        g.appendChild(self.monthLabels())
-        g.appendChild(self.frame())
+    def element(self, parent=None):
+        g = adopt(parent, self.picture.group())
+        self.monthSections(g)
+        if self.events is not None:
+            self.eventOverlay(g)
+        if self.comparisons:
+            self.latitudeBands(g)
+        self.monthLabels(g)
+        self.frame(g)
+        if self.today is not None and self.includes(self.today):
+            self.todayMarker(self.today, g)
         return g
 
+    # Return whether the date |day| falls within this calendar, and so can
+    # be marked as today.
+    def includes(self, day):
+        return self.startDate <= day <= self.endDate
+
+    # Return the date whose part of the spiral lies under the point (x, y),
+    # or None if the point is off the calendar.
+    def dateAt(self, x, y):
+        hit = self.spiral.fromXY(x, y)
+        if hit is None:
+            return None
+        when = hit[0]
+        if not toDatetime(self.startDate) <= when < toDatetime(self.endDate):
+            return None
+        return when.date()
+
+    # Return a list of the events in self.events on the date under the
+    # point (x, y).
+    def eventsAt(self, x, y):
+        d = self.dateAt(x, y)
+        if d is None or self.events is None:
+            return []
+        return sorted(self.events.overlapping(d, d + timedelta(1)), key=lambda e: (e.start, e.end))
+
     # Return the start of the next month after |date|.
     @classmethod
     def nextMonth(self, date):
@@ -241,33 +1212,141 @@ class Calendar(object):
             yield(d, min(n, end))
             d = n
 
+    # Yield (first, last) pairs of dates, both inclusive, dividing the days
+    # from self.startDate through self.endDate into months.
+    def monthDays(self):
+        months = list(Calendar.months(self.startDate, self.endDate))
+        if not months:
+            yield (self.startDate, self.endDate)
+            return
+        for (start, end) in months:
+            yield (start, end if end == self.endDate else end - timedelta(1))
+
+    # Return |compute()|, a list of PathBuilders that |name| and |args|
+    # identify, given our spiral. Fetch it from self.cache if possible. The
+    # cache holds geometry, not path data, so one entry serves every output
+    # profile.
+    def fragment(self, name, args, compute):
+        if self.cache is None:
+            return compute()
+        key = (name, args, self.spiral.parameters())
+        value = self.cache.get(key)
+        if value is not None:
+            return [PathBuilder.fromBytes(b) for b in value]
+        paths = compute()
+        self.cache.put(key, [p.toBytes() for p in paths])
+        return paths
+
     # Draw alternating gray and white backgrounds for the months.
-    def monthSections(self):
-        g = self.picture.group()
-        gray=True
-        for (sectionStart, sectionEnd) in Calendar.months(self.startDate, self.endDate):
-            p = self.picture.path(self.spiral.section(sectionStart, sectionEnd, 0, 1))
-            setAttributes(p, stroke='none', fill='rgb(230,230,230)' if gray else 'white')
-            g.appendChild(p)
-            gray = not gray
+    def monthSections(self, parent=None):
+        g = adopt(parent, self.picture.group())
+        fills = ['rgb(230,230,230)', 'white']
+        merged = [[], []]
+        for (i, (sectionStart, sectionEnd)) in enumerate(Calendar.months(self.startDate, self.endDate)):
+            [d] = self.fragment('monthSection', (sectionStart, sectionEnd),
+                                lambda: [self.spiral.section(sectionStart, sectionEnd, 0, 1)])
+            if self.mergePaths:
+                merged[i % 2].append(self.picture.pathData(d))
+            else:
+                g.appendChild(self.picture.path(d, stroke='none', fill=fills[i % 2]))
+        if self.mergePaths:
+            for (fill, d) in zip(fills, merged):
+                if d:
+                    g.appendChild(self.picture.path(' '.join(d), stroke='none', fill=fill))
+        return g
+
+    # Draw the events from self.events that fall between our start and end
+    # dates: those lasting a day or more as sections across the spiral, and
+    # shorter ones as lines at their start times. Only the events in range
+    # are ever looked at.
+    # |events| is the EventIndex to draw from, if not self.events.
+    def eventOverlay(self, parent=None, events=None):
+        g = adopt(parent, self.picture.group())
+        (start, end) = (toDatetime(self.startDate), toDatetime(self.endDate))
+        # Sort, so that the output doesn't depend on the index's layout.
+        index = self.events if events is None else events
+        events = sorted(index.overlapping(start, end), key=lambda e: (e.start, e.end))
+        spans = [self.spanPath(max(e.start, start), min(e.end, end), 0, 1)
+                 for e in events if e.end - e.start >= timedelta(1)]
+        # A marker shows a moment, so one before the calendar starts has
+        # nowhere to go, even if its event runs into the calendar.
+        markers = [self.spiral.radial(e.start, 0, 1)
+                   for e in events if e.end - e.start < timedelta(1) and e.start >= start]
+
+        spanGroup = self.picture.group(fill='rgb(255,215,160)', stroke='none')
+        markerGroup = self.picture.group(fill='none', stroke='rgb(230,120,0)')
+        markerGroup.setAttribute('stroke-width', '2')
+        for (group, paths) in ((spanGroup, spans), (markerGroup, markers)):
+            adopt(g, group)
+            if self.mergePaths:
+                if paths:
+                    group.appendChild(self.picture.path(' '.join(map(self.picture.pathData,
+                                                                     paths))))
+            else:
+                for d in paths:
+                    group.appendChild(self.picture.path(d))
         return g
 
+    # Draw a band for each latitude in self.comparisons, centered on the
+    # spiral, whose width each day is the proportion of it the sun is up
+    # there. The day lengths for all the latitudes are computed together, as
+    # are all the bands' points, and each band is a single path.
+    def latitudeBands(self, parent=None):
+        g = adopt(parent, self.picture.group(stroke='none'))
+        g.setAttribute('fill-opacity', '0.35')
+        days = list(dateRange(self.startDate, self.endDate, 1))
+        grid = self.dayLengths.grid(self.comparisons, self.startDate, self.endDate)
+        # Each band runs out along its upper edge and back along its lower.
+        dates = days + days[::-1]
+        if numpy is not None:
+            half = numpy.asarray(grid) / 2
+            radii = numpy.hstack((0.5 + half, (0.5 - half)[:, ::-1]))
+            (xs, ys) = self.spiral.toXYs(dates, radii)
+        else:
+            radii = [[0.5 + l / 2 for l in row] + [0.5 - l / 2 for l in reversed(row)]
+                     for row in grid]
+            points = [[self.spiral.toXY(d, r) for (d, r) in zip(dates, row)] for row in radii]
+            (xs, ys) = ([[x for (x, y) in row] for row in points],
+                        [[y for (x, y) in row] for row in points])
+        for (i, colour) in zip(xrange(len(grid)), itertools.cycle(comparisonColours)):
+            path = PathBuilder()
+            path.polyline(xs[i], ys[i], close=True)
+            g.appendChild(self.picture.path(path, fill=colour))
+        return g
+
+    # Return a section of the spiral from |start| to |end|, between radii
+    # |r1| and |r2|, with its edges cut into arcs no longer than spiralStep
+    # days, so that even a long span follows the spiral.
+    def spanPath(self, start, end, r1, r2):
+        if self.spiral.tolerance is not None:
+            return self.spiral.section(start, end, r1, r2)
+        dates = list(dateRange(start, end, self.spiralStep))
+        path = self.spiral.moveTo(start, r1)
+        for (a, b) in zip(dates, dates[1:]):
+            self.spiral.segment(a, b, r1, path)
+        self.spiral.lineTo(end, r2, path)
+        for (a, b) in zip(dates[:0:-1], dates[-2::-1]):
+            self.spiral.segment(a, b, r2, path)
+        path.close()
+        return path
+
     def freshId(self, prefix):
         self.nextId = self.nextId + 1
         return "%s-%d" % (prefix, self.nextId)
 
     # Build a label on a spiral. Display |text| on a path from |start| to
-    # |end| at |radius|. Add the path as a child of |defs|, and add
-    # the label itself as a child of |labels|.
-    def spiralLabel(self, text, start, end, radius, defs, labels):
+    # |end| at |radius|. Add the path as a child of |defs|, and return the
+    # label itself.
+    def spiralLabel(self, text, start, end, radius, defs):
         id = self.freshId('spiralLabelPath')
 
         # First, the path. Give these lines stroke and stroke width, even
         # though they're in a 'defs'; we occasionally like to see them for
         # debugging.
-        p = self.picture.path(self.spiral.moveTo(start, radius)
-                              + self.spiral.segment(start, end, radius),
-                              id=id, stroke='black', fill='none')
+        [d] = self.fragment('spiralLabel', (start, end, radius),
+                            lambda: [self.spiral.segment(start, end, radius,
+                                                         self.spiral.moveTo(start, radius))])
+        p = self.picture.path(d, id=id, stroke='black', fill='none')
         p.setAttribute('stroke-width', '4')
 
         # Then, the label text.
@@ -277,116 +1356,403 @@ class Calendar(object):
         t.appendChild(tp)
 
         defs.appendChild(p)
-        labels.appendChild(t)
+        return t
 
     # Labels for the months.
-    def monthLabels(self):
-        g = self.picture.group(fill='rgb(190,190,190)')
+    def monthLabels(self, parent=None):
+        g = adopt(parent, self.picture.group(fill='rgb(190,190,190)'))
         g.setAttribute('font-size', "40")
 
         d = self.picture.defs()
         g.appendChild(d)
 
+        # Fill in all the defs before adding any labels, so the defs are
+        # complete before anything follows them.
+        labels = []
         doneYear = None
         for (start, end) in Calendar.months(self.startDate, self.endDate):
             # Month label. Stretch out the interval to cover the whole
             # month's span. Use day numbers acceptable in all months.
             start = start.replace(day=3)
             end = start.replace(day=28)
-            self.spiralLabel(start.strftime("%B"), start, end, 1.2, d, g)
+            labels.append(self.spiralLabel(start.strftime("%B"), start, end, 1.2, d))
 
             # Year label.
             if start.year != doneYear:
                 doneYear = start.year
-                self.spiralLabel(start.strftime('%Y'), start, end, -0.6, d, g)
+                labels.append(self.spiralLabel(start.strftime('%Y'), start, end, -0.6, d))
 
+        for t in labels:
+            g.appendChild(t)
         return g
 
     # The "frame": spirals, day lines, Monday dates
-    def frame(self):
+    def frame(self, parent=None):
 
-        def spiral(r):
-            dates = dateRange(self.startDate, self.endDate, 10)
+        def spiral(r, d=None):
+            # An adaptive spiral chooses its own pieces.
+            if self.spiral.tolerance is not None:
+                d = self.spiral.moveTo(self.startDate, r, d)
+                return self.spiral.segment(self.startDate, self.endDate, r, d)
+            dates = dateRange(self.startDate, self.endDate, self.spiralStep)
             prev = dates.next()
-            d = self.spiral.moveTo(prev, r)
+            d = self.spiral.moveTo(prev, r, d)
             for t in dates:
-                d = d + self.spiral.segment(prev, t, r)
+                self.spiral.segment(prev, t, r, d)
                 prev = t
-            return self.picture.path(d)
+            return d
 
         def weekId(date, prefix=""):
             iso = date.isocalendar()
             return "%sweek-%d-%d" % (prefix, iso[0], iso[1])
 
-        f = picture.group()
+        # A label for Monday |date|'s day within the month, on the path we
+        # create for it below.
+        def mondayLabel(date):
+            tp = self.picture.textPath(" %d" % (date.day,))
+            tp.setAttribute('xlink:href', weekId(date, '#'))
+            t = self.picture.text(None)
+            t.setAttribute('fill', 'black')
+            t.setAttribute('stroke', 'none')
+            t.appendChild(tp)
+            return t
+
+        f = adopt(parent, self.picture.group())
         f.setAttribute('fill', 'none')
         f.setAttribute('stroke', 'black')
         f.setAttribute('stroke-width', '1')
 
-        f.appendChild(spiral(0))        # inner spiral edge
-        f.appendChild(spiral(1))        # outer spiral edge
+        if self.mergePaths:
+            f.appendChild(self.picture.path(spiral(1, spiral(0))))
+        else:
+            f.appendChild(self.picture.path(spiral(0)))     # inner spiral edge
+            f.appendChild(self.picture.path(spiral(1)))     # outer spiral edge
 
         # A defs element, to hold the paths for the Monday date labels.
+        days = self.detail >= DETAIL_DAYS
         ld = self.picture.defs()
         f.appendChild(ld)
+        for (first, last) in self.monthDays() if days else []:
+            mondays = [d for d in dateRange(first, last, 1) if d.weekday() == 0]
+            paths = self.fragment('mondayLabels', (first, last),
+                                  lambda: self.mondayLabelPaths(first, last))
+            for (d, i) in zip(mondays, paths):
+                ld.appendChild(self.picture.path(i, id=weekId(d)))
 
-        # Day/week lines.
-        for d in dateRange(self.startDate, self.endDate, 1):
-            if d.weekday():
-                l = dayLength(d, self.latitude) / 2
-                p = self.picture.path(self.spiral.radial(d, 0.5 - l, 0.5 + l))
-            else:
-                p = self.picture.path(self.spiral.radial(d, 0.0, 1.0))
-            # if d == date.today():
-            #    p.setAttribute('stroke-width', '4')
-            f.appendChild(p)
+        # Day/week lines. When merging, all the weekday lines go in one
+        # path, and all the Monday lines in another.
+        (weekdays, mondays) = ([], [])
+        for (first, last) in self.monthDays() if self.detail >= DETAIL_WEEKS else []:
+            paths = self.fragment('dayLines', (first, last, self.latitude, self.dayLengths.altitude),
+                                  lambda: self.dayLinePaths(first, last))
+            for (d, p) in zip(dateRange(first, last, 1), paths):
+                if d.weekday() and not days:
+                    continue
+                if self.mergePaths:
+                    (weekdays if d.weekday() else mondays).append(self.picture.pathData(p))
+                    continue
+
+                f.appendChild(self.picture.path(p))
+
+                # If this day is a Monday, label its day within the month.
+                if d.weekday() == 0 and days:
+                    f.appendChild(mondayLabel(d))
+
+        if self.mergePaths:
+            for paths in (weekdays, mondays):
+                if paths:
+                    f.appendChild(self.picture.path(' '.join(paths)))
+            for d in dateRange(self.startDate, self.endDate, 1) if days else []:
+                if d.weekday() == 0:
+                    f.appendChild(mondayLabel(d))
 
-            # If this day is a Monday, label its day within the month.
+        return f
+
+    # Return a heavy line over |day|'s day line, marking it as today.
+    def todayMarker(self, day, parent=None):
+        p = adopt(parent, self.picture.path(self.dayLinePaths(day, day)[0],
+                                            fill='none', stroke='black'))
+        p.setAttribute('stroke-width', '4')
+        return p
+
+    # Return a today marker that moves through each of the dates |days| in
+    # turn, staying |seconds| on each, and starting over after the last.
+    # Dates outside the calendar are skipped; if that leaves none, return
+    # None.
+    def todayAnimation(self, days, seconds, parent=None):
+        paths = [self.picture.pathData(self.dayLinePaths(d, d)[0])
+                 for d in days if self.includes(d)]
+        if not paths:
+            return None
+        p = adopt(parent, self.picture.path(paths[0], fill='none', stroke='black'))
+        p.setAttribute('stroke-width', '4')
+        p.appendChild(self.picture.animate(attributeName='d', values=';'.join(paths),
+                                           dur='%gs' % (seconds * len(paths)),
+                                           calcMode='discrete', repeatCount='indefinite'))
+        return p
+
+    # Return a list of paths for the Monday date labels to follow, one for
+    # each Monday from |first| through |last|.
+    def mondayLabelPaths(self, first, last):
+        paths = []
+        for d in dateRange(first, last, 1):
             if d.weekday() == 0:
-                # Create a path for the label to follow. (Convert to
-                # datetime, so we can space in by fractional days.)
+                # Convert to datetime, so we can space in by fractional days.
                 labelStart = toDatetime(d) + timedelta(0.3)
-                i = (self.spiral.moveTo(labelStart, .8)
-                     + self.spiral.section(labelStart, labelStart + timedelta(7), .8, .8))
-                lp = self.picture.path(i, id=weekId(d))
-                ld.appendChild(lp)
-                # Create a day-of-month label, on that path.
-                tp = self.picture.textPath(" %d" % (d.day,))
-                tp.setAttribute('xlink:href', weekId(d, '#'))
-                t = self.picture.text(None)
-                t.setAttribute('fill', 'black')
-                t.setAttribute('stroke', 'none')
-                t.appendChild(tp)
-                f.appendChild(t)
+                paths.append(self.spiral.section(labelStart, labelStart + timedelta(7), .8, .8))
+        return paths
 
-        return f
+    # Return a list of paths for the day lines from |first| through |last|,
+    # one per day. Mondays get a line all the way across the spiral; other
+    # days get a line whose length shows how long the sun is up.
+    def dayLinePaths(self, first, last):
+        paths = []
+        lengths = self.dayLengths.lengths(self.latitude, first, last)
+        for (d, l) in zip(dateRange(first, last, 1), lengths):
+            if d.weekday():
+                l = l / 2
+                paths.append(self.spiral.radial(d, 0.5 - l, 0.5 + l))
+            else:
+                paths.append(self.spiral.radial(d, 0.0, 1.0))
+        return paths
 
-if __name__ == "__main__":
+# Add options for choosing an OutputProfile to the argparse parser
+# |parser|, for a script that writes |name|.svg.
+def addProfileArguments(parser, name):
+    parser.add_argument('--precision', type=int, default=1, metavar='DIGITS',
+                        help="digits after the decimal point in path coordinates "
+                        "(default: %(default)s)")
+    parser.add_argument('--relative', action='store_true',
+                        help="write paths with relative and shorthand commands")
+    parser.add_argument('--compact', action='store_true',
+                        help="don't indent the XML")
+    parser.add_argument('--svgz', action='store_true',
+                        help="write gzipped %s.svgz instead of %s.svg" % (name, name))
+
+# Return the OutputProfile chosen by the parsed arguments |args|.
+def profileFromArguments(args):
+    return OutputProfile(precision=args.precision, relative=args.relative,
+                         pretty=not args.compact, compress=args.svgz)
+
+# The average length of a year.
+yearLength = timedelta(365 + (1.0/4) - (1.0/100) + (1.0/400))
 
-    # Dimensions of the page, in inches
-    pageSizeInches = ('24in', '24in')
-    pageSize = (24 * 72, 24 * 72)
+# Return a picture of a white square page |pageInches| inches on a side, and
+# a Calendar from |startDate| to |endDate| at |latitude| to draw on it,
+# centered. The picture is a StreamingSVGPicture writing to |out| if
+# |stream| is true, and keeps its paths' geometry if |geometry| is true (see
+# SVGPicture). The other arguments are as for writeCalendar.
+def calendarPage(startDate, endDate, latitude, pageInches, topRadius, nextTopRadius, thickness,
+                 tolerance, profile, stream=False, out=None, geometry=False, **options):
+    pageSizeInches = ('%gin' % pageInches,) * 2
+    pageSize = (int(pageInches * 72),) * 2
     center = (pageSize[0]/2, pageSize[1]/2)
+    topDate = date(startDate.year, 1, 1)
 
     # The whole picture.
-    picture = SVGPicture(pageSizeInches, pageSize)
+    if stream:
+        picture = StreamingSVGPicture(out, pageSizeInches, pageSize, profile)
+    else:
+        picture = SVGPicture(pageSizeInches, pageSize, profile, geometry)
 
     # Background.
     picture.root.appendChild(picture.rect((0, 0), pageSize, fill='white', stroke='none'))
 
-    year = 2018
-    topDate = date(year,1,1)
-    yearLength = timedelta(365 + (1.0/4) - (1.0/100) + (1.0/400))
+    calendar = Calendar(picture,
+                        Spiral(center=center,
+                               topDate = topDate, nextTopDate = topDate + yearLength,
+                               topRadius = topRadius, nextTopRadius = nextTopRadius,
+                               thickness = thickness, tolerance = tolerance),
+                        startDate, endDate, latitude, **options)
+    return (picture, calendar)
+
+# Draw a calendar from |startDate| to |endDate| at |latitude| on a square
+# page |pageInches| inches on a side, and write it as SVG to the file |out|.
+# The spiral is centered on the page, reaching its top each January 1st;
+# |topRadius|, |nextTopRadius| and |thickness| are as for Spiral, taking
+# |startDate|'s January 1st as the top date, and |tolerance| is also as for
+# Spiral. If |stream| is true, write the elements as they are generated.
+# If |pdf| is true, write PDF instead of SVG; |out| should then be a binary
+# file. |profile| is an OutputProfile saying how to write the SVG; if it
+# compresses, |out| should be a binary file too. Pass any other keyword
+# arguments along to Calendar.
+def writeCalendar(out, startDate, endDate, latitude, pageInches=24,
+                  topRadius=475, nextTopRadius=600, thickness=70, tolerance=None,
+                  stream=False, pdf=False, profile=None, **options):
+    profile = profile or defaultProfile
+    if stream and pdf:
+        raise ValueError("can't stream PDF output")
+    if pdf and profile.compress:
+        raise ValueError("PDF output is already compressed")
+
+    with profile.output(out) as out:
+        (picture, calendar) = calendarPage(startDate, endDate, latitude, pageInches,
+                                           topRadius, nextTopRadius, thickness, tolerance,
+                                           profile, stream, out, pdf, **options)
+        calendar.element(picture.root)
+
+        if stream:
+            picture.close()
+        elif pdf:
+            import pdf_backend
+            pdf_backend.writePDF(picture, out)
+            return
+        else:
+            picture.write(out)
+        print >> out
+
+# A serialized SVGPicture with holes in it: |placeholders| are elements in
+# |picture|, which we write as text once, keeping the text between them.
+# Writing the template then writes other elements in their places.
+class DocumentTemplate(object):
+    def __init__(self, picture, placeholders):
+        self.profile = picture.profile
+        (self.addindent, self.newl) = self.profile.indentation()
+        text = StringIO()
+        picture.write(text)
+        print >> text
+        text = text.getvalue()
+
+        # Split the text at each placeholder, noting the indentation
+        # before it.
+        self.texts = []
+        self.indents = []
+        for placeholder in placeholders:
+            marker = placeholder.toxml()
+            at = text.index(marker)
+            lineStart = text.rfind('\n', 0, at) + 1
+            if self.newl and not text[lineStart:at].strip():
+                (before, indent) = (text[:lineStart], text[lineStart:at])
+            else:
+                (before, indent) = (text[:at], '')
+            self.texts.append(before)
+            self.indents.append(indent)
+            text = text[at + len(marker) + len(self.newl):]
+        self.texts.append(text)
+
+    # Write the document to |out|, with the elements |elements| in place of
+    # the placeholders; where an element is None, write nothing.
+    def write(self, out, elements):
+        with self.profile.output(out) as out:
+            for (text, indent, element) in zip(self.texts, self.indents, elements):
+                out.write(text)
+                if element is not None:
+                    element.writexml(out, indent, self.addindent, self.newl)
+            out.write(self.texts[-1])
+
+# A calendar drawn once, to be written many times with different events
+# over it, or different days marked as today. The arguments are as for
+# writeCalendar, except that templates can't be streamed or written as PDF,
+# and |options| can't include events or today.
+#
+# We serialize the whole document once, with placeholders where
+# Calendar.element puts the event overlay and the today marker, as a
+# DocumentTemplate. Writing a variant then only draws its overlay and
+# marker.
+class CalendarTemplate(object):
+    def __init__(self, startDate, endDate, latitude, pageInches=24,
+                 topRadius=475, nextTopRadius=600, thickness=70, tolerance=None,
+                 profile=None, **options):
+        self.profile = profile or defaultProfile
+        (self.picture, self.calendar) = calendarPage(startDate, endDate, latitude, pageInches,
+                                                     topRadius, nextTopRadius, thickness,
+                                                     tolerance, self.profile, **options)
+        g = self.calendar.element(self.picture.root)
+        # The overlay goes just after the month backgrounds, and the marker
+        # after everything.
+        placeholders = (self.picture.doc.createElement('overlay-placeholder'),
+                        self.picture.doc.createElement('today-placeholder'))
+        g.insertBefore(placeholders[0], g.firstChild.nextSibling)
+        g.appendChild(placeholders[1])
+        self.document = DocumentTemplate(self.picture, placeholders)
+
+    # Write the calendar to |out|, with the events in the EventIndex
+    # |events| drawn over it and the date |today| marked, exactly as
+    # writeCalendar would with |events| and |today| among its options. If
+    # either is None, leave it out; like writeCalendar, mark |today| only if
+    # it falls within the calendar.
+    def write(self, out, events=None, today=None):
+        marked = today is not None and self.calendar.includes(today)
+        self.document.write(out, [
+            None if events is None else self.calendar.eventOverlay(events=events),
+            self.calendar.todayMarker(today) if marked else None,
+        ])
+
+    # Write the calendar to |out| as an animation marking each of the
+    # dates |days| that fall within it as today in turn, spending |seconds|
+    # on each, with |events| as for write.
+    def writeAnimation(self, out, days, seconds, events=None):
+        self.document.write(out, [
+            None if events is None else self.calendar.eventOverlay(events=events),
+            self.calendar.todayAnimation(days, seconds),
+        ])
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Write a spiral calendar to calendar.svg.")
+    parser.add_argument('--stream', action='store_true',
+                        help="write elements as they are generated, rather than "
+                        "building the whole document in memory first")
+    parser.add_argument('--merge', action='store_true',
+                        help="draw each layer of like shapes as a single path, "
+                        "rather than one element per day")
+    parser.add_argument('--tolerance', type=float, metavar='PIXELS',
+                        help="draw the spiral with Bezier curves accurate to within "
+                        "this many pixels, rather than circular arcs")
+    parser.add_argument('--pdf', action='store_true',
+                        help="write calendar.pdf, ready to print, instead of calendar.svg")
+    addProfileArguments(parser, 'calendar')
+    parser.add_argument('--cache', metavar='DIRECTORY',
+                        help="keep each month's geometry in this directory, and reuse it "
+                        "in later runs")
+    parser.add_argument('--events', metavar='FILE', action='append',
+                        help="draw the events in this .ics or .csv file; may be repeated")
+    parser.add_argument('--compare', metavar='LATITUDE', type=float, action='append',
+                        help="show how long the sun is up at this latitude too, as a "
+                        "coloured band; may be repeated")
+    parser.add_argument('--today', metavar='YYYY-MM-DD', nargs='?', const=date.today(),
+                        type=lambda s: datetime.strptime(s, '%Y-%m-%d').date(),
+                        help="mark this day, or if no date is given, today")
+    parser.add_argument('--profile', metavar='JSON',
+                        help="time each stage of drawing, and write a report to this file")
+    args = parser.parse_args()
+
+    profiler = None
+    if args.profile:
+        import pdf_backend
+        from profiling import Profiler
+        profiler = Profiler()
+        profiler.install(sys.modules[__name__], pdf_backend)
+
+    cache = None
+    if args.cache:
+        from fragment_cache import FragmentCache
+        cache = FragmentCache(args.cache)
+
+    events = None
+    if args.events:
+        from events import EventIndex, readEventFile
+        events = EventIndex([e for filename in args.events for e in readEventFile(filename)])
+
     startDate = date(2018, 6, 1)
     endDate =   date(2019, 5, 31)
     latitude = 45 # Portland, OR
-    picture.root.appendChild(Calendar(picture,
-                                      Spiral(center=center,
-                                             topDate = topDate, nextTopDate = topDate + yearLength,
-                                             topRadius = 475, nextTopRadius = 600, thickness = 70),
-                                      startDate, endDate, latitude)
-                             .element());
-
-    with open('calendar.svg', 'w') as f:
-        picture.doc.writexml(f, addindent='  ', newl='\n')
-        print >> f
+
+    profile = profileFromArguments(args)
+    if args.pdf:
+        filename = 'calendar.pdf'
+    else:
+        filename = 'calendar.svgz' if profile.compress else 'calendar.svg'
+    with open(filename, 'wb' if args.pdf or profile.compress else 'w') as f:
+        writeCalendar(f, startDate, endDate, latitude,
+                      pageInches = 24, # dimensions of the page, in inches
+                      topRadius = 475, nextTopRadius = 600, thickness = 70,
+                      tolerance=args.tolerance, stream=args.stream, pdf=args.pdf,
+                      profile=profile, mergePaths=args.merge, cache=cache, events=events,
+                      today=args.today, comparisons=args.compare)
+
+    if profiler:
+        profiler.uninstall()
+        profiler.write(args.profile)
+        profiler.summary(sys.stderr)
@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
-import codecs, math
+import argparse, codecs, math, sys
 
-from gen_calendar import SVGPicture, interp, setAttributes
+from gen_calendar import (SVGPicture, StreamingSVGPicture, addProfileArguments, adopt,
+                          defaultProfile, interp, needNumpy, numpy, pathOrNew,
+                          profileFromArguments, setAttributes)
 
 # A coordinate transformation, taking angles and radii to cartesian points
 # on a circular band.
@@ -16,6 +18,8 @@ from gen_calendar import SVGPicture, interp, setAttributes
 # radii range from 0 to 1; 0 means the inner edge of the band, and 1 means
 # the outer edge of the band.
 class CircularBand(object):
+    __slots__ = ('center', 'radius', 'thickness', 'cycle')
+
     def __init__(self, center, radius, thickness, cycle):
         self.center = center
         self.radius = radius
@@ -32,47 +36,100 @@ class CircularBand(object):
         a = float(angle) / self.cycle * 2 * math.pi
         return (cx + math.sin(a) * pxr, cy - math.cos(a) * pxr)
 
-    # A path command to move to |angle|, |radius|. The command has no
-    # trailing or leading spaces.
-    def moveTo(self, angle, radius):
-        return "M %.1f %.1f" % self.toXY(angle, radius)
-
-    # A path command to draw a straight line from the current position to
-    # |angle|, |radius|. The command starts with a space.
-    def lineTo(self, angle, radius):
-        return " L %.1f %.1f" % self.toXY(angle, radius)
-
-    # A path command for a circular arc from angle1 to angle2, at radius r.
-    # This assumes that the current path position is spiral.toXY(angle1,
-    # r). The command begins with a space.
-    def segment(self, angle1, angle2, r):
-        pxr = self.pixelRadius(r)
-        return (" A %.1f %.1f 0 0 %d %.1f %.1f"
-                % ((pxr, pxr, (1 if angle2 > angle1 else 0)) + self.toXY(angle2, r)))
-
-    # A path command for a section from angle d1 to d2, and radius r1 to r2.
-    def section(self, angle1, angle2, r1, r2):
-        return (self.moveTo(angle1, r1)
-                + self.segment(angle1, angle2, r1)
-                + self.lineTo(angle2, r2)
-                + self.segment(angle2, angle1, r2)
-                + " Z")
-
-    # A path command for a line radiating out from the center at angle d,
+    # Batched versions of pixelRadius and toXY, taking arrays of angles and
+    # radii (or single numbers, which broadcast) and returning NumPy arrays.
+    def pixelRadii(self, radii):
+        needNumpy()
+        return interp(self.radius, self.radius + self.thickness, numpy.asarray(radii, dtype=float))
+
+    # Return a pair of arrays (xs, ys), the coordinates of the points
+    # (|angles|[i], |radii|[i]).
+    def toXYs(self, angles, radii):
+        (cx, cy) = self.center
+        pxr = self.pixelRadii(radii)
+        a = numpy.asarray(angles, dtype=float) / self.cycle * 2 * numpy.pi
+        return (cx + numpy.sin(a) * pxr, cy - numpy.cos(a) * pxr)
+
+    # The inverse of toXY. Return (angle, radius) for the point (x, y), or
+    # None if it isn't on the band.
+    def fromXY(self, x, y):
+        (cx, cy) = self.center
+        (dx, dy) = (x - cx, cy - y)
+        radius = (math.hypot(dx, dy) - self.radius) / self.thickness
+        if not 0 <= radius <= 1:
+            return None
+        return (math.atan2(dx, dy) / (2 * math.pi) % 1.0 * self.cycle, radius)
+
+    # A batched fromXY. Return a triple of arrays (angles, radii, hits),
+    # where |hits| says which of the points are on the band.
+    def fromXYs(self, xs, ys):
+        needNumpy()
+        (cx, cy) = self.center
+        (dx, dy) = (numpy.asarray(xs, dtype=float) - cx, cy - numpy.asarray(ys, dtype=float))
+        radii = (numpy.hypot(dx, dy) - self.radius) / self.thickness
+        angles = numpy.arctan2(dx, dy) / (2 * numpy.pi) % 1.0 * self.cycle
+        return (angles, radii, (0 <= radii) & (radii <= 1))
+
+    # Append a command to move to |angle|, |radius| to |path|, and return
+    # |path|. As with all the path methods below, |path| is a
+    # PathBuilder; if omitted, we start a new one.
+    def moveTo(self, angle, radius, path=None):
+        path = pathOrNew(path)
+        path.moveTo(self.toXY(angle, radius))
+        return path
+
+    # Append a command to draw a straight line from the current position
+    # to |angle|, |radius|.
+    def lineTo(self, angle, radius, path=None):
+        path = pathOrNew(path)
+        path.lineTo(self.toXY(angle, radius))
+        return path
+
+    # Append a command for a circular arc from angle1 to angle2, at radius
+    # r. This assumes that the current path position is
+    # band.toXY(angle1, r).
+    def segment(self, angle1, angle2, r, path=None):
+        path = pathOrNew(path)
+        path.arc(self.pixelRadius(r), angle2 > angle1, self.toXY(angle2, r))
+        return path
+
+    # Append commands for a section from angle d1 to d2, and radius r1 to r2.
+    def section(self, angle1, angle2, r1, r2, path=None):
+        path = self.moveTo(angle1, r1, path)
+        self.segment(angle1, angle2, r1, path)
+        self.lineTo(angle2, r2, path)
+        self.segment(angle2, angle1, r2, path)
+        path.close()
+        return path
+
+    # Append commands for a line radiating out from the center at angle d,
     # starting at radius r1, and ending at radius r2.
-    def radial(self, d, r1, r2):
-        return self.moveTo(d, r1) + self.lineTo(d, r2)
+    def radial(self, d, r1, r2, path=None):
+        return self.lineTo(d, r2, self.moveTo(d, r1, path))
 
+    # Return an SVG transform that turns the band |angle| units clockwise
+    # about its center. Since the band looks the same at every angle,
+    # anything drawn at angle a, transformed this way, lands where it would
+    # be if drawn at angle a + |angle|.
+    def rotation(self, angle):
+        return 'rotate(%g %g %g)' % ((float(angle) / self.cycle * 360,) + tuple(self.center))
+
+# If |reuse| is true, draw each distinct shape once, in a 'defs' element,
+# and place each day's copy with a rotation: the day sections become 'use'
+# elements, and the labels are rotated 'text' elements that share one path
+# per radius.
 class Week(object):
-    def __init__(self, picture, band):
+    def __init__(self, picture, band, reuse=False):
         self.picture = picture
         self.band = band
+        self.reuse = reuse
+        self.labelPaths = {}
         self.nextId = 0
 
-    def element(self):
-        g = self.picture.group()
-        g.appendChild(self.daySections())
-        g.appendChild(self.dayLabels())
+    def element(self, parent=None):
+        g = adopt(parent, self.picture.group())
+        self.daySections(g)
+        self.dayLabels(g)
         return g
 
     def freshId(self, prefix):
@@ -81,78 +138,168 @@ class Week(object):
 
     # Build a label on a circular arc. Display |text| on a path from
     # |start| to |end| at |radius|. Add the path as a child of |defs|, and
-    # add the label itself as a child of |labels|.
-    def arcLabel(self, text, start, end, radius, defs, labels):
-        id = self.freshId('arcLabelPath')
-
-        # First, the path. Give these lines stroke and stroke width, even
-        # though they're in a 'defs'; we occasionally like to see them for
-        # debugging.
-        p = self.picture.path(self.band.moveTo(start, radius)
-                              + self.band.segment(start, end, radius),
-                              id=id, stroke='black', fill='none')
-        p.setAttribute('stroke-width', '4')
+    # return the label itself.
+    #
+    # When reusing shapes, draw the path as if |start| were in the first
+    # unit of the cycle, and rotate the label into place, so that labels
+    # at the same offset and radius in different units share a path.
+    def arcLabel(self, text, start, end, radius, defs):
+        turn = int(math.floor(start)) if self.reuse else 0
+        # Round away the floating-point noise of subtracting |turn|, so
+        # that equal offsets match.
+        (start, end) = (round(start - turn, 9), round(end - turn, 9)) if turn else (start, end)
+        key = (start, end, radius)
+        id = self.labelPaths.get(key)
+        if id is None:
+            id = self.freshId('arcLabelPath')
+            if self.reuse:
+                self.labelPaths[key] = id
+
+            # First, the path. Give these lines stroke and stroke width, even
+            # though they're in a 'defs'; we occasionally like to see them for
+            # debugging.
+            d = self.band.segment(start, end, radius, self.band.moveTo(start, radius))
+            p = self.picture.path(d, id=id, stroke='black', fill='none')
+            p.setAttribute('stroke-width', '4')
+            defs.appendChild(p)
 
         # Then, the label text.
         tp = self.picture.textPath(text)
         tp.setAttribute('xlink:href', '#' + id)
         t = self.picture.text(None)
+        if turn:
+            t.setAttribute('transform', self.band.rotation(turn))
         t.appendChild(tp)
+        return t
 
-        defs.appendChild(p)
-        labels.appendChild(t)
-
-    def daySections(self):
-        g = self.picture.group()
+    def daySections(self, parent=None):
+        g = adopt(parent, self.picture.group())
         setAttributes(g, stroke='black', fill='none')
         g.setAttribute('stroke-width', '4')
+        if self.reuse:
+            # Draw the first day's sector, and rotate copies of it into
+            # place for the rest.
+            id = self.freshId('daySection')
+            g.appendChild(self.picture.path(self.band.section(0, 1, 0, 1), id=id))
+            for i in xrange(1, 7):
+                g.appendChild(self.picture.use('#' + id, transform=self.band.rotation(i)))
+            return g
         for i in xrange(7):
             p = self.picture.path(self.band.section(i, i+1, 0, 1))
             g.appendChild(p)
         return g
 
-    def dayLabels(self):
-        g = self.picture.group(fill='rgb(220,220,220)')
+    def dayLabels(self, parent=None):
+        g = adopt(parent, self.picture.group(fill='rgb(220,220,220)'))
 
         d = self.picture.defs()
         g.appendChild(d)
 
+        # Fill in all the defs before adding any labels, so the defs are
+        # complete before anything follows them.
+        labels = []
+
         english_days = ['Monday', 'Tuesday',  'Wednesday', 'Thursday',
                         'Friday', 'Saturday', 'Sunday']
         hiragana_days = [u'げつようび', u'かようび', u'すいようび', u'もくようび',
                          u'きんようび', u'どようび', u'にちようび']
         kanji_days = u'月火水木金土日'
         for i in xrange(7):
-            self.arcLabel(english_days[i], i+0.05, i+1, 0.1, d, g)
-            g.lastChild.setAttribute('font-size', '40')
+            t = self.arcLabel(english_days[i], i+0.05, i+1, 0.1, d)
+            t.setAttribute('font-size', '40')
+            labels.append(t)
 
-            self.arcLabel(hiragana_days[i], i+0.05, i+1, 0.33, d, g)
-            g.lastChild.setAttribute('font-size', '40')
+            t = self.arcLabel(hiragana_days[i], i+0.05, i+1, 0.33, d)
+            t.setAttribute('font-size', '40')
+            labels.append(t)
 
-            self.arcLabel(kanji_days[i], i+0.03, i+1, 0.6, d, g)
-            g.lastChild.setAttribute('font-size', '80')
+            t = self.arcLabel(kanji_days[i], i+0.03, i+1, 0.6, d)
+            t.setAttribute('font-size', '80')
+            labels.append(t)
 
+        for t in labels:
+            g.appendChild(t)
         return g
 
 
-if __name__ == '__main__':
-
-    # Dimensions of the page, in inches
-    pageSizeInches = ('18in', '18in')
-    pageSize = (18*72, 18*72)
+# Draw a week diagram on a square page |pageInches| inches on a side, and
+# write it as SVG to the file |out|. |radius|, |thickness| and |cycle| are
+# as for CircularBand. If |stream| is true, write the elements as they are
+# generated. If |pdf| is true, write PDF instead of SVG; |out| should then
+# be a binary file. |profile| is an OutputProfile saying how to write the
+# SVG; if it compresses, |out| should be a binary file too. |reuse| is as
+# for Week.
+def writeWeek(out, pageInches=18, radius=350, thickness=200, cycle=7, stream=False, pdf=False,
+              profile=None, reuse=False):
+    profile = profile or defaultProfile
+    if stream and pdf:
+        raise ValueError("can't stream PDF output")
+    if pdf and profile.compress:
+        raise ValueError("PDF output is already compressed")
+    pageSizeInches = ('%gin' % pageInches,) * 2
+    pageSize = (int(pageInches * 72),) * 2
     center = (pageSize[0]/2, pageSize[1]/2)
 
-    # The whole picture.
-    picture = SVGPicture(pageSizeInches, pageSize)
+    with profile.output(out) as out:
+        # The whole picture.
+        if stream:
+            picture = StreamingSVGPicture(out, pageSizeInches, pageSize, profile)
+        else:
+            picture = SVGPicture(pageSizeInches, pageSize, profile, geometry=pdf)
+
+        # Background.
+        picture.root.appendChild(picture.rect((0, 0), pageSize, fill='white', stroke='none'))
+
+        # The week.
+        Week(picture, CircularBand(center, radius=radius, thickness=thickness, cycle=cycle),
+             reuse=reuse).element(picture.root)
+
+        if stream:
+            picture.close()
+        elif pdf:
+            import pdf_backend
+            pdf_backend.writePDF(picture, out)
+            return
+        else:
+            picture.write(out)
+        print >> out
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Write a week diagram to week.svg.")
+    parser.add_argument('--stream', action='store_true',
+                        help="write elements as they are generated, rather than "
+                        "building the whole document in memory first")
+    parser.add_argument('--pdf', action='store_true',
+                        help="write week.pdf, ready to print, instead of week.svg")
+    parser.add_argument('--reuse', action='store_true',
+                        help="draw each distinct shape once, and place each day's copy "
+                        "with a rotation")
+    addProfileArguments(parser, 'week')
+    parser.add_argument('--profile', metavar='JSON',
+                        help="time each stage of drawing, and write a report to this file")
+    args = parser.parse_args()
 
-    # Background.
-    picture.root.appendChild(picture.rect((0, 0), pageSize, fill='white', stroke='none'))
+    profiler = None
+    if args.profile:
+        import gen_calendar
+        import pdf_backend
+        from profiling import Profiler
+        profiler = Profiler()
+        profiler.install(sys.modules[__name__], gen_calendar, pdf_backend)
 
-    # The week.
-    picture.root.appendChild(Week(picture,
-                                  CircularBand(center, radius=350, thickness=200, cycle=7))
-                             .element())
+    profile = profileFromArguments(args)
+    if args.pdf:
+        f = open('week.pdf', 'wb')
+    elif profile.compress:
+        f = open('week.svgz', 'wb')
+    else:
+        f = codecs.open('week.svg', 'w', encoding='utf-8')
+    with f:
+        writeWeek(f, pageInches=18, radius=350, thickness=200, cycle=7,
+                  stream=args.stream, pdf=args.pdf, profile=profile, reuse=args.reuse)
 
-    with codecs.open('week.svg', 'w', encoding='utf-8') as f:
-        picture.doc.writexml(f, addindent='  ', newl='\n')
-        print >> f
+    if profiler:
+        profiler.uninstall()
+        profiler.write(args.profile)
+        profiler.summary(sys.stderr)
@@ -0,0 +1,426 @@
+"""Write an SVGPicture directly as PDF, for printing without Inkscape.
+
+This understands exactly the SVG that gen_calendar.py and gen_week.py
+produce: rectangles, lines and paths (with the path commands PathBuilder
+emits), groups with inherited fill, stroke, stroke-width, font-size,
+fill-opacity and stroke-opacity,
+text laid along a path with textPath, 'use' elements, and rotate and
+translate transforms. Arcs become cubic Bezier curves, and
+text on a path is placed glyph by glyph, each glyph centered on the path
+and turned to follow it, as SVG renderers do.
+
+Text is set in Helvetica, one of the fonts every PDF viewer provides, so
+nothing is embedded. That font only covers the Windows-1252 character set;
+other characters, like the Japanese day names in week.svg, are set in
+HeiseiKakuGo-W5, one of the standard Japanese fonts, which isn't embedded
+either: viewers use their own Japanese font in its place. Characters
+neither font can encode are left out, with a warning.
+"""
+
+import math
+import re
+import warnings
+import zlib
+
+from gen_calendar import PathBuilder, arcToCurves
+
+# Advance widths of Helvetica's characters, in thousandths of an em, for
+# the printable ASCII characters, from Adobe's font metrics.
+helveticaWidths = dict(zip(
+    [chr(c) for c in range(32, 127)],
+    [278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+     556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+     1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+     667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+     333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+     556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584]))
+
+# The width to assume for characters outside printable ASCII.
+defaultWidth = 556
+
+# The fonts text may use: Helvetica, for the characters Windows-1252 has,
+# and a standard Japanese font for the rest of the Basic Multilingual
+# Plane, as PDF objects referring to each other by their offsets from the
+# first object's number. The Japanese font's glyphs are all taken to be an
+# em wide, as the kana and kanji are.
+helveticaFont = [
+    '<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>',
+]
+japaneseFont = [
+    '<< /Type /Font /Subtype /Type0 /BaseFont /HeiseiKakuGo-W5 /Encoding /UniJIS-UCS2-H'
+    ' /DescendantFonts [%(1)d 0 R] >>',
+    '<< /Type /Font /Subtype /CIDFontType0 /BaseFont /HeiseiKakuGo-W5'
+    ' /CIDSystemInfo << /Registry (Adobe) /Ordering (Japan1) /Supplement 2 >>'
+    ' /FontDescriptor %(2)d 0 R /DW 1000 >>',
+    '<< /Type /FontDescriptor /FontName /HeiseiKakuGo-W5 /Flags 4'
+    ' /FontBBox [-92 -250 1010 922] /ItalicAngle 0 /Ascent 752 /Descent -221'
+    ' /CapHeight 737 /StemV 114 >>',
+]
+
+# The style properties we track, and their initial values. The font size
+# is Inkscape's default, to match what the README's Inkscape command
+# produces.
+initialStyle = {'fill': 'black', 'stroke': 'none', 'stroke-width': '1', 'font-size': '12',
+                'fill-opacity': '1', 'stroke-opacity': '1'}
+
+namedColors = {'black': (0, 0, 0), 'white': (255, 255, 255)}
+
+# Return |color| as an (r, g, b) tuple of numbers from 0 to 1, or None if
+# it is 'none'.
+def parseColor(color):
+    color = color.strip()
+    if color == 'none':
+        return None
+    if color in namedColors:
+        rgb = namedColors[color]
+    else:
+        match = re.match(r'rgb\(\s*(\d+)\s*,\s*(\d+)\s*,\s*(\d+)\s*\)$', color)
+        if match:
+            rgb = [int(c) for c in match.groups()]
+        elif re.match(r'#[0-9a-fA-F]{6}$', color):
+            rgb = [int(color[i:i+2], 16) for i in (1, 3, 5)]
+        else:
+            raise ValueError("unsupported color: %r" % (color,))
+    return tuple(c / 255.0 for c in rgb)
+
+# Return the length |length| (like '24in' or '1728') in points.
+def parseLength(length):
+    match = re.match(r'([-+0-9.eE]+)\s*(in|pt|px|)$', length.strip())
+    if not match:
+        raise ValueError("unsupported length: %r" % (length,))
+    (number, unit) = match.groups()
+    return float(number) * (72 if unit == 'in' else 1)
+
+# Return the SVG transform list |transform| as a PDF matrix (a, b, c, d, e,
+# f). We understand rotate, translate and matrix.
+def parseTransform(transform):
+    matrix = (1, 0, 0, 1, 0, 0)
+    for (name, args) in re.findall(r'(\w+)\s*\(([^)]*)\)', transform):
+        args = [float(a) for a in re.split(r'[\s,]+', args.strip())]
+        if name == 'translate':
+            (tx, ty) = (args + [0])[:2]
+            m = (1, 0, 0, 1, tx, ty)
+        elif name == 'rotate':
+            a = math.radians(args[0])
+            (c, s) = (math.cos(a), math.sin(a))
+            (cx, cy) = args[1:3] if len(args) >= 3 else (0, 0)
+            m = (c, s, -s, c, cx - c * cx + s * cy, cy - s * cx - c * cy)
+        elif name == 'matrix':
+            m = tuple(args)
+        else:
+            raise ValueError("unsupported transform: %r" % (transform,))
+        matrix = multiply(matrix, m)
+    return matrix
+
+# Return the matrix that applies |m2| and then |m1|, as SVG's transform
+# lists compose.
+def multiply(m1, m2):
+    (a1, b1, c1, d1, e1, f1) = m1
+    (a2, b2, c2, d2, e2, f2) = m2
+    return (a1 * a2 + c1 * b2, b1 * a2 + d1 * b2,
+            a1 * c2 + c1 * d2, b1 * c2 + d1 * d2,
+            a1 * e2 + c1 * f2 + e1, b1 * e2 + d1 * f2 + f1)
+
+def escapeString(s):
+    return s.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+# Return the PathBuilder for the path element |element|: the one it was
+# made from, if the picture kept it, or else its path data, parsed.
+def geometry(element):
+    path = getattr(element, 'geometry', None)
+    if path is None:
+        path = PathBuilder.fromString(element.getAttribute('d'))
+    return path
+
+# Yield the (x, y) points of |path| (a PathBuilder), flattened into a
+# series of polylines, each a list of points.
+def flatten(path, samples=16):
+    current = start = (0, 0)
+    line = []
+    for (command, args) in path.commands:
+        if command == 'M':
+            if len(line) > 1:
+                yield line
+            current = start = args
+            line = [current]
+            continue
+        if command == 'L':
+            line.append(args)
+        elif command == 'A':
+            for curve in arcToCurves(*(current + args)):
+                line.extend(sampleCurve(current, curve, samples))
+                current = curve[4:]
+        elif command == 'C':
+            line.extend(sampleCurve(current, args, samples))
+        elif command == 'Z':
+            line.append(start)
+            args = start
+        current = tuple(args[-2:])
+    if len(line) > 1:
+        yield line
+
+def sampleCurve((x0, y0), (x1, y1, x2, y2, x3, y3), samples):
+    points = []
+    for i in xrange(1, samples + 1):
+        t = float(i) / samples
+        u = 1 - t
+        points.append((u*u*u*x0 + 3*u*u*t*x1 + 3*u*t*t*x2 + t*t*t*x3,
+                       u*u*u*y0 + 3*u*u*t*y1 + 3*u*t*t*y2 + t*t*t*y3))
+    return points
+
+# Walks an SVGPicture's document, producing a PDF content stream for it.
+class PDFRenderer(object):
+    def __init__(self, picture):
+        self.root = picture.root
+        self.pageSize = (parseLength(self.root.getAttribute('width')),
+                         parseLength(self.root.getAttribute('height')))
+        viewBox = [float(v) for v in self.root.getAttribute('viewBox').split()]
+        self.scale = self.pageSize[0] / viewBox[2]
+        self.origin = viewBox[:2]
+        self.ops = []
+        # The resource names of the fonts the text has used.
+        self.fonts = set()
+        # The graphics states setting opacity that the content uses, as a
+        # map from (fill, stroke) opacities to resource names, and the
+        # opacities currently in effect.
+        self.states = {}
+        self.opacity = (1.0, 1.0)
+
+        # Elements with ids, for textPath references.
+        self.ids = {}
+        self.collectIds(self.root)
+
+    def collectIds(self, element):
+        for child in element.childNodes:
+            if child.nodeType == child.ELEMENT_NODE:
+                if child.getAttribute('id'):
+                    self.ids[child.getAttribute('id')] = child
+                self.collectIds(child)
+
+    # Return the content stream, as a string.
+    def render(self):
+        # Flip the y axis and scale, so that we can use SVG user
+        # coordinates directly.
+        s = self.scale
+        self.ops.append('%g 0 0 %g %g %g cm' % (s, -s, -self.origin[0] * s,
+                                               self.pageSize[1] + self.origin[1] * s))
+        self.walk(self.root, initialStyle)
+        return '\n'.join(self.ops) + '\n'
+
+    def walk(self, element, style):
+        tag = element.tagName
+        if tag == 'defs':
+            return
+        style = dict(style)
+        for name in initialStyle:
+            if element.hasAttribute(name):
+                style[name] = element.getAttribute(name)
+
+        if element.getAttribute('transform'):
+            self.ops.append('q %.6f %.6f %.6f %.6f %.4f %.4f cm'
+                            % parseTransform(element.getAttribute('transform')))
+            opacity = self.opacity
+            self.draw(element, tag, style)
+            self.ops.append('Q')
+            self.opacity = opacity
+        else:
+            self.draw(element, tag, style)
+
+    def draw(self, element, tag, style):
+        if tag in ('svg', 'g'):
+            for child in element.childNodes:
+                if child.nodeType == child.ELEMENT_NODE:
+                    self.walk(child, style)
+        elif tag == 'rect':
+            self.setOpacity(style)
+            self.ops.append('%s %s %s %s re' % tuple(self.number(element, a)
+                                                    for a in ('x', 'y', 'width', 'height')))
+            self.paint(style)
+        elif tag == 'line':
+            self.setOpacity(style)
+            self.ops.append('%s %s m %s %s l' % tuple(self.number(element, a)
+                                                     for a in ('x1', 'y1', 'x2', 'y2')))
+            self.paint(style)
+        elif tag == 'path':
+            self.setOpacity(style)
+            self.pathOps(geometry(element))
+            self.paint(style)
+        elif tag == 'text':
+            for child in element.childNodes:
+                if child.nodeType == child.ELEMENT_NODE and child.tagName == 'textPath':
+                    self.textPath(child, style)
+        elif tag == 'use':
+            # Draw the referenced element here, inheriting our style.
+            target = self.ids.get(element.getAttribute('xlink:href').lstrip('#'))
+            if target is not None:
+                self.walk(target, style)
+
+    def number(self, element, attribute):
+        return '%.2f' % float(element.getAttribute(attribute) or 0)
+
+    def pathOps(self, path):
+        current = start = (0, 0)
+        for (command, args) in path.commands:
+            if command == 'M':
+                self.ops.append('%.2f %.2f m' % args)
+                start = args
+            elif command == 'L':
+                self.ops.append('%.2f %.2f l' % args)
+            elif command == 'A':
+                for curve in arcToCurves(*(current + args)):
+                    self.ops.append('%.2f %.2f %.2f %.2f %.2f %.2f c' % curve)
+            elif command == 'C':
+                self.ops.append('%.2f %.2f %.2f %.2f %.2f %.2f c' % args)
+            elif command == 'Z':
+                self.ops.append('h')
+                args = start
+            current = tuple(args[-2:])
+
+    # Make |style|'s fill and stroke opacities the current ones. This must
+    # come before the path is built, since a graphics state can't be set
+    # in the middle of one.
+    def setOpacity(self, style):
+        opacity = (float(style['fill-opacity']), float(style['stroke-opacity']))
+        if opacity != self.opacity:
+            name = self.states.setdefault(opacity, 'GS%d' % (len(self.states) + 1))
+            self.ops.append('/%s gs' % name)
+            self.opacity = opacity
+
+    # Set the colors and line width for |style|, and fill and stroke the
+    # current path accordingly.
+    def paint(self, style):
+        fill = parseColor(style['fill'])
+        stroke = parseColor(style['stroke'])
+        if fill:
+            self.ops.append('%.3f %.3f %.3f rg' % fill)
+        if stroke:
+            self.ops.append('%.3f %.3f %.3f RG %s w' % (stroke + (float(style['stroke-width']),)))
+        self.ops.append('B' if fill and stroke else 'f' if fill else 'S' if stroke else 'n')
+
+    # Lay out the text of |textPath| along the path it refers to.
+    def textPath(self, textPath, style):
+        style = dict(style)
+        for name in initialStyle:
+            if textPath.hasAttribute(name):
+                style[name] = textPath.getAttribute(name)
+        target = self.ids.get(textPath.getAttribute('xlink:href').lstrip('#'))
+        if target is None:
+            return
+        lines = list(flatten(geometry(target)))
+        if not lines:
+            return
+        walker = PathWalker(lines[0])
+        text = ''.join(c.data for c in textPath.childNodes if c.nodeType == c.TEXT_NODE)
+        size = float(style['font-size'])
+        fill = parseColor(style['fill'])
+        stroke = parseColor(style['stroke'])
+        if not fill and not stroke:
+            return
+
+        self.setOpacity(style)
+        self.ops.append('BT')
+        if fill:
+            self.ops.append('%.3f %.3f %.3f rg' % fill)
+        if stroke:
+            self.ops.append('%.3f %.3f %.3f RG %s w' % (stroke + (float(style['stroke-width']),)))
+        self.ops.append('%d Tr' % (2 if fill and stroke else 0 if fill else 1))
+        offset = 0
+        font = None
+        for c in text:
+            glyph = self.glyph(c)
+            if glyph is None:
+                continue
+            (name, string, width) = glyph
+            width = width * size / 1000
+            middle = offset + width / 2
+            if middle > walker.length:
+                break
+            if name != font:
+                self.ops.append('/%s %g Tf' % (name, size))
+                self.fonts.add(name)
+                font = name
+            ((x, y), (tx, ty)) = walker.at(middle)
+            self.ops.append('%.4f %.4f %.4f %.4f %.2f %.2f Tm %s Tj'
+                            % (tx, ty, ty, -tx, x - tx * width / 2, y - ty * width / 2, string))
+            offset = offset + width
+        self.ops.append('ET')
+
+    # Return the font resource name, PDF string and width in thousandths of
+    # an em with which to show the character |c|, or None if no font we
+    # have can show it.
+    def glyph(self, c):
+        try:
+            encoded = c.encode('cp1252')
+        except UnicodeError:
+            pass
+        else:
+            width = helveticaWidths.get(encoded, defaultWidth)
+            return ('F1', '(%s)' % escapeString(encoded), width)
+        encoded = c.encode('utf-16-be')
+        if len(encoded) != 2:
+            warnings.warn("no PDF font for %r; leaving it out" % (c,))
+            return None
+        return ('F2', '<%s>' % encoded.encode('hex'), 1000)
+
+# Finds points and directions at given distances along a polyline.
+class PathWalker(object):
+    def __init__(self, points):
+        self.points = points
+        self.distances = [0]
+        for (p, q) in zip(points, points[1:]):
+            self.distances.append(self.distances[-1] + math.hypot(q[0] - p[0], q[1] - p[1]))
+        self.length = self.distances[-1]
+
+    # Return the point |distance| along the polyline, and the unit vector
+    # in the direction of travel there.
+    def at(self, distance):
+        i = 1
+        while i < len(self.distances) - 1 and self.distances[i] < distance:
+            i = i + 1
+        (p, q) = (self.points[i - 1], self.points[i])
+        span = self.distances[i] - self.distances[i - 1]
+        t = (distance - self.distances[i - 1]) / span if span else 0
+        (dx, dy) = (q[0] - p[0], q[1] - p[1])
+        norm = math.hypot(dx, dy) or 1
+        return ((p[0] + t * dx, p[1] + t * dy), (dx / norm, dy / norm))
+
+# Write |picture|, an SVGPicture (not a StreamingSVGPicture, since that
+# doesn't keep its elements), to the binary file |out| as a one-page PDF.
+def writePDF(picture, out):
+    renderer = PDFRenderer(picture)
+    content = zlib.compress(renderer.render())
+    objects = [
+        '<< /Type /Catalog /Pages 2 0 R >>',
+        '<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+        None,
+        '<< /Length %d /Filter /FlateDecode >>\nstream\n%s\nendstream' % (len(content), content),
+    ]
+    fonts = []
+    for (name, font) in (('F1', helveticaFont), ('F2', japaneseFont)):
+        if name in renderer.fonts or name == 'F1':
+            first = len(objects) + 1
+            fonts.append('/%s %d 0 R' % (name, first))
+            numbers = dict((str(i), first + i) for i in xrange(len(font)))
+            objects.extend(o % numbers for o in font)
+    resources = '/Font << %s >>' % ' '.join(fonts)
+    if renderer.states:
+        resources += ' /ExtGState << %s >>' % ' '.join(
+            '/%s << /ca %g /CA %g >>' % ((name,) + opacity)
+            for (opacity, name) in sorted(renderer.states.items(), key=lambda s: s[1]))
+    objects[2] = ('<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %g %g] /Resources << %s >>'
+                  ' /Contents 4 0 R >>' % (renderer.pageSize + (resources,)))
+
+    written = [0]
+    def write(s):
+        out.write(s)
+        written[0] += len(s)
+    write('%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+    offsets = []
+    for (i, body) in enumerate(objects):
+        offsets.append(written[0])
+        write('%d 0 obj\n%s\nendobj\n' % (i + 1, body))
+    xref = written[0]
+    write('xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1))
+    for offset in offsets:
+        write('%010d 00000 n \n' % offset)
+    write('trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref))
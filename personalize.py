@@ -0,0 +1,104 @@
+"""Write one calendar per person or family, each with their own events drawn
+over the same calendar.
+
+    $ python personalize.py 2018-06-01 2019-05-31 class.csv --latitude 45 -o 'out/{name}.svg'
+
+class.csv is a CSV file of events like those events.readCSV reads, with one
+more column, "Name" by default, saying whose calendar each row goes on:
+
+    Name,Subject,Start Date,End Date
+    Garcia,Ana's birthday,2018-09-14,
+    Garcia,Visiting grandparents,2018-12-22,2019-01-02
+    Okafor,Chidi's birthday,2019-03-02,
+    ,Winter break,2018-12-24,2019-01-04
+
+Rows with no name go on everyone's calendar. A name with no events (a row
+with just the name) still gets a plain calendar. Names keep their letters,
+in any script, in the file names; characters that aren't safe there become
+underscores, and names that would still share a file get "-2", "-3" and so
+on added, so no calendar overwrites another.
+
+The calendar is drawn and serialized once, as a gen_calendar.CalendarTemplate;
+each person's calendar then costs only drawing their events.
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+import unicodedata
+
+from batch_render import parseDate
+from events import EventIndex, readCSVGroups
+from fragment_cache import makeDirectories
+from gen_calendar import CalendarTemplate, addProfileArguments, profileFromArguments
+
+# Return the Unicode string |name| made safe to use as part of a file name,
+# as UTF-8.
+def fileName(name):
+    name = unicodedata.normalize('NFC', name)
+    safe = re.sub(r'[^\w.-]+', '_', name, flags=re.UNICODE).strip('._') or u'unnamed'
+    return safe.encode('utf-8')
+
+# Write a calendar from |template| for each group of events in |groups|, as
+# readCSVGroups returns them, to the file named by |pattern| with {name}
+# replaced by the group's name. Where two names would be written to the
+# same file, add a number to the later one. Return the list of files
+# written.
+def writeVariants(template, groups, pattern):
+    shared = groups.get(u'', [])
+    written = []
+    used = set()
+    for (name, events) in groups.items():
+        if not name:
+            continue
+        base = fileName(name)
+        (filename, n) = (pattern.format(name=base), 1)
+        while os.path.normcase(os.path.abspath(filename)) in used:
+            n = n + 1
+            filename = pattern.format(name='%s-%d' % (base, n))
+        used.add(os.path.normcase(os.path.abspath(filename)))
+        directory = os.path.dirname(filename)
+        if directory:
+            makeDirectories(directory)
+        with open(filename, 'wb' if template.profile.compress else 'w') as f:
+            template.write(f, EventIndex(shared + events))
+        written.append(filename)
+    return written
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Write a calendar for each person named in a "
+                                     "CSV file of events.")
+    parser.add_argument('start', type=parseDate, help="first date, as YYYY-MM-DD")
+    parser.add_argument('end', type=parseDate, help="last date, as YYYY-MM-DD")
+    parser.add_argument('events', help="CSV file of events, with a column naming whose they are")
+    parser.add_argument('--latitude', type=float, default=45,
+                        help="latitude for the day lengths (default: %(default)s)")
+    parser.add_argument('--column', default='Name',
+                        help="the column naming whose calendar each event goes on "
+                        "(default: %(default)s)")
+    parser.add_argument('-o', '--output', default='{name}.svg',
+                        help="file to write each calendar to, with {name} replaced by the "
+                        "person's name (default: %(default)s)")
+    parser.add_argument('--merge', action='store_true',
+                        help="draw each layer of like shapes as a single path, "
+                        "rather than one element per day")
+    addProfileArguments(parser, '{name}')
+    args = parser.parse_args()
+
+    profile = profileFromArguments(args)
+    pattern = args.output
+    if profile.compress and pattern.endswith('.svg'):
+        pattern = pattern + 'z'
+
+    with open(args.events, 'rb') as f:
+        groups = readCSVGroups(f, args.column)
+
+    start = time.time()
+    template = CalendarTemplate(args.start, args.end, args.latitude, profile=profile,
+                                mergePaths=args.merge)
+    drawn = time.time()
+    written = writeVariants(template, groups, pattern)
+    print >> sys.stderr, 'template %.2fs; %d calendars %.2fs' % (drawn - start, len(written),
+                                                                time.time() - drawn)
@@ -0,0 +1,151 @@
+"""Count and time the stages of drawing a calendar or week diagram.
+
+    profiler = Profiler()
+    with profiler.installed(gen_calendar, pdf_backend):
+        gen_calendar.writeCalendar(...)
+    profiler.write('profile.json')
+    profiler.summary(sys.stderr)
+
+installed replaces each stage's function or method in the given modules
+with a wrapper that counts calls and accumulates time, and puts the
+originals back afterwards. Nothing is wrapped unless a Profiler is
+installed, so ordinary runs pay nothing for this module.
+
+For each stage, the report gives the number of calls, the cumulative time
+spent in them (including the stages they call), and the time spent in the
+stage itself, excluding the other stages it calls. The wrappers' own
+overhead falls on the calling stage, so for stages called hundreds of
+thousands of times, like Spiral.toXY, the callers' times are somewhat
+inflated.
+"""
+
+import json
+import platform
+import sys
+import timeit
+from contextlib import contextmanager
+from datetime import datetime
+
+# The stages to instrument, as 'function' or 'Class.method', looked up in
+# each module passed to Profiler.install. Stages a module doesn't define
+# are skipped.
+stages = [
+    # Top level.
+    'writeCalendar', 'writeWeek', 'CalendarTemplate.__init__', 'CalendarTemplate.write',
+
+    # Drawing.
+    'Calendar.element', 'Calendar.monthSections', 'Calendar.eventOverlay',
+    'Calendar.monthLabels', 'Calendar.frame', 'Calendar.fragment', 'Calendar.todayMarker',
+    'Calendar.todayAnimation', 'Calendar.latitudeBands',
+    'Week.element', 'Week.daySections', 'Week.dayLabels',
+
+    # Coordinate and path math.
+    'Spiral.toXY', 'Spiral.toXYs', 'Spiral.moveTo', 'Spiral.lineTo', 'Spiral.segment',
+    'Spiral.section', 'Spiral.radial',
+    'CircularBand.toXY', 'CircularBand.toXYs', 'CircularBand.moveTo', 'CircularBand.lineTo',
+    'CircularBand.segment', 'CircularBand.section', 'CircularBand.radial',
+    'OutputProfile.pathData',
+
+    # Day lengths.
+    'dayLength', 'DayLengthTable.__call__', 'DayLengthTable.lengths',
+    'DayLengthTable.computeYear', 'DayLengthTable.grid', 'DayLengthTable.computeGrid',
+
+    # Element creation.
+    'SVGPicture.line', 'SVGPicture.rect', 'SVGPicture.group', 'SVGPicture.path',
+    'SVGPicture.textPath', 'SVGPicture.text', 'SVGPicture.defs',
+
+    # Serialization.
+    'SVGPicture.write', 'StreamDocument.append', 'StreamDocument.close', 'writePDF',
+]
+
+# |clock| is the function to time stages with; by default, wall-clock time.
+# Pass time.clock to measure processor time instead, which varies less on a
+# busy machine.
+class Profiler(object):
+    def __init__(self, clock=timeit.default_timer):
+        self.clock = clock
+        self.stats = {}         # stage -> [calls, seconds, self seconds]
+        self.active = []        # [stage, seconds in called stages], for each call in progress
+        self.patches = []       # (owner, attribute, original)
+
+    # Return a function that calls |function|, charging the time to |name|.
+    def wrap(self, name, function):
+        stats = self.stats.setdefault(name, [0, 0.0, 0.0])
+        active = self.active
+        clock = self.clock
+        def wrapper(*args, **kwargs):
+            call = [name, 0.0]
+            active.append(call)
+            start = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = clock() - start
+                active.pop()
+                stats[0] += 1
+                stats[2] += elapsed - call[1]
+                # Don't count a stage's time twice if it calls itself.
+                if not any(c[0] == name for c in active):
+                    stats[1] += elapsed
+                if active:
+                    active[-1][1] += elapsed
+        wrapper.__name__ = function.__name__
+        wrapper.__doc__ = function.__doc__
+        return wrapper
+
+    # Instrument the stages that |modules| define.
+    def install(self, *modules):
+        patched = set((id(owner), attribute) for (owner, attribute, original) in self.patches)
+        for module in modules:
+            for stage in stages:
+                (owner, dot, attribute) = stage.rpartition('.')
+                owner = getattr(module, owner, None) if owner else module
+                # Only wrap things where they're defined, and only once,
+                # even if several modules import them.
+                if owner is None or attribute not in vars(owner):
+                    continue
+                if (id(owner), attribute) in patched:
+                    continue
+                original = vars(owner)[attribute]
+                setattr(owner, attribute, self.wrap(stage, original))
+                self.patches.append((owner, attribute, original))
+                patched.add((id(owner), attribute))
+
+    # Put back everything install replaced.
+    def uninstall(self):
+        while self.patches:
+            (owner, attribute, original) = self.patches.pop()
+            setattr(owner, attribute, original)
+
+    @contextmanager
+    def installed(self, *modules):
+        self.install(*modules)
+        try:
+            yield self
+        finally:
+            self.uninstall()
+
+    # Return the report, as a dictionary ready for JSON: the stages that were
+    # called, slowest first.
+    def report(self):
+        results = [{'name': name, 'calls': calls, 'seconds': seconds, 'selfSeconds': selfSeconds}
+                   for (name, (calls, seconds, selfSeconds)) in self.stats.items() if calls]
+        results.sort(key=lambda r: (-r['seconds'], r['name']))
+        return {
+            'when': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'argv': sys.argv,
+            'stages': results,
+        }
+
+    def write(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.report(), f, indent=2, sort_keys=True)
+            print >> f
+
+    # Print the report as a table to |out|.
+    def summary(self, out):
+        print >> out, '%-30s %10s %10s %10s' % ('stage', 'calls', 'seconds', 'self')
+        for r in self.report()['stages']:
+            print >> out, '%-30s %10d %10.4f %10.4f' % (r['name'], r['calls'], r['seconds'],
+                                                       r['selfSeconds'])
@@ -0,0 +1,391 @@
+"""Render a calendar as a pyramid of SVG tiles, for posters too big to draw
+or view as one picture.
+
+    $ python tile_calendar.py 1950-01-01 2031-12-31 --latitude 45 --levels 6 -o tiles
+
+This writes tiles/{z}/{x}/{y}.svg for each zoom level z from 0 up to one
+less than --levels, where level z covers the page with 2**z by 2**z tiles,
+each --tile-size pixels square, and tiles/tiles.json describing them. The
+page is just big enough to hold the whole spiral.
+
+Lower levels leave out detail too fine to see at their scale: below a few
+pixels per day, the day lines and Monday dates go, and below a few pixels
+per week, the Monday lines too (see Calendar's |detail|).
+
+Each worker process draws the calendar once for each level of detail,
+sharing the drawing between the levels that use it, and puts the bounding
+box of every element in a grid index for each level. Each tile then gets just the
+elements whose boxes cross it, along with the groups they sit in and the
+label paths their text follows. Long open paths, like the spiral's edges,
+are cut into short pieces first, so that a tile carries only the nearby
+stretch of them.
+"""
+
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import sys
+import time
+from datetime import date
+
+from batch_render import parseDate
+from fragment_cache import makeDirectories
+from gen_calendar import (Calendar, DETAIL_DAYS, DETAIL_OUTLINE, DETAIL_WEEKS, PathBuilder,
+                          SVGPicture, Spiral, arcToCurves, yearLength)
+
+# Draw a level with day lines only if they are at least this many pixels
+# apart on the spiral's innermost turn, and similarly for week lines.
+minimumSpacing = 3
+
+# The most drawing commands to keep together in one piece of an open path.
+pieceLength = 8
+
+# Extra room around each element's bounding box, for stroke widths.
+boxMargin = 4
+
+detailNames = {DETAIL_OUTLINE: 'outline', DETAIL_WEEKS: 'weeks', DETAIL_DAYS: 'days'}
+
+# The parameters of a set of tiles. This is small, so it can be passed to
+# each worker with every tile; the workers draw the levels themselves.
+class TileSet(object):
+    def __init__(self, startDate, endDate, latitude, levels=4, tileSize=256,
+                 topRadius=475, nextTopRadius=600, thickness=70, spiralStep=10):
+        self.startDate = startDate
+        self.endDate = endDate
+        self.latitude = latitude
+        self.levels = levels
+        self.tileSize = tileSize
+        self.topRadius = topRadius
+        self.nextTopRadius = nextTopRadius
+        self.thickness = thickness
+        self.spiralStep = spiralStep
+
+        # Make the page big enough for the outermost turn and its labels.
+        spiral = self.spiral((0, 0))
+        outer = spiral.proportionRadius(spiral.dateToProportion(endDate), 1.2)
+        self.pageSize = 2 * int(math.ceil(outer + 100))
+
+    def key(self):
+        return tuple(sorted(vars(self).items()))
+
+    def spiral(self, center):
+        topDate = date(self.startDate.year, 1, 1)
+        return Spiral(center=center, topDate=topDate, nextTopDate=topDate + yearLength,
+                      topRadius=self.topRadius, nextTopRadius=self.nextTopRadius,
+                      thickness=self.thickness)
+
+    # Return the number of pixels per user unit at level |zoom|.
+    def scale(self, zoom):
+        return float(self.tileSize) * 2 ** zoom / self.pageSize
+
+    # Return the Calendar detail to draw at level |zoom|.
+    def detail(self, zoom):
+        spiral = self.spiral((0, 0))
+        inner = spiral.proportionRadius(spiral.dateToProportion(self.startDate), 0)
+        day = self.scale(zoom) * 2 * math.pi * inner / spiral.circumDays
+        if day >= minimumSpacing:
+            return DETAIL_DAYS
+        if 7 * day >= minimumSpacing:
+            return DETAIL_WEEKS
+        return DETAIL_OUTLINE
+
+    def description(self):
+        return {
+            'start': self.startDate.isoformat(),
+            'end': self.endDate.isoformat(),
+            'latitude': self.latitude,
+            'pageSize': self.pageSize,
+            'tileSize': self.tileSize,
+            'levels': [{'zoom': z, 'tiles': 2 ** z, 'scale': self.scale(z),
+                        'detail': detailNames[self.detail(z)]}
+                       for z in xrange(self.levels)],
+        }
+
+# A bucket grid over the square from (0, 0) to (|size|, |size|), |cells|
+# buckets on a side, holding items with bounding boxes.
+class GridIndex(object):
+    def __init__(self, size, cells):
+        self.cellSize = float(size) / cells
+        self.cells = cells
+        self.buckets = {}
+
+    def bucketsFor(self, (x0, y0, x1, y1)):
+        def clamp(v):
+            return min(self.cells - 1, max(0, int(v / self.cellSize)))
+        for i in xrange(clamp(x0), clamp(x1) + 1):
+            for j in xrange(clamp(y0), clamp(y1) + 1):
+                yield (i, j)
+
+    def insert(self, box, item):
+        for key in self.bucketsFor(box):
+            self.buckets.setdefault(key, []).append((box, item))
+
+    # Return the items whose boxes intersect |box|, in the order they were
+    # inserted, if items are numbered in that order.
+    def query(self, box):
+        (x0, y0, x1, y1) = box
+        found = {}
+        for key in self.bucketsFor(box):
+            for ((a0, b0, a1, b1), item) in self.buckets.get(key, ()):
+                if a0 <= x1 and x0 <= a1 and b0 <= y1 and y0 <= b1:
+                    found[id(item)] = item
+        return sorted(found.values())
+
+# Return the bounding box of the PathBuilder |path|'s commands. Curves lie
+# within their control points, so we use those.
+def pathBox(commands):
+    xs = []
+    ys = []
+    current = (0, 0)
+    for (command, args) in commands:
+        if command == 'A':
+            for curve in arcToCurves(*(current + args)):
+                xs.extend(curve[0::2])
+                ys.extend(curve[1::2])
+        elif command != 'Z':
+            xs.extend(args[0::2])
+            ys.extend(args[1::2])
+        if args:
+            current = tuple(args[-2:])
+    if not xs:
+        return None
+    return (min(xs), min(ys), max(xs), max(ys))
+
+# Split |commands| into lists of commands, each starting with a move: one
+# per subpath, except that open subpaths are cut every pieceLength
+# commands. Drawing the pieces draws the same picture.
+def splitPath(commands):
+    pieces = []
+    current = (0, 0)
+    for (command, args) in commands:
+        if command == 'M' or not pieces:
+            pieces.append([('M', args if command == 'M' else current)])
+            if command != 'M':
+                pieces[-1].append((command, args))
+        elif (len(pieces[-1]) > pieceLength and command != 'Z'
+              and all(c != 'Z' for (c, a) in pieces[-1])):
+            pieces.append([('M', current), (command, args)])
+        else:
+            pieces[-1].append((command, args))
+        if args:
+            current = tuple(args[-2:])
+    # Closed subpaths were never cut, so pieces that close are whole.
+    return pieces
+
+def expand((x0, y0, x1, y1), margin):
+    return (x0 - margin, y0 - margin, x1 + margin, y1 + margin)
+
+# A TileSet's calendar, drawn whole at the Calendar detail |detail|, and
+# broken into leaves to hand out to tiles.
+class TileDrawing(object):
+    def __init__(self, tiles, detail):
+        self.tiles = tiles
+        size = tiles.pageSize
+        picture = SVGPicture(('%d' % size,) * 2, (size, size))
+        picture.root.appendChild(picture.rect((0, 0), (size, size), fill='white', stroke='none'))
+        Calendar(picture, tiles.spiral((size / 2, size / 2)), tiles.startDate, tiles.endDate,
+                 tiles.latitude, spiralStep=tiles.spiralStep, detail=detail).element(picture.root)
+
+        self.definitions = {}   # id -> element, for the contents of 'defs' elements
+        self.leaves = []
+        self.collect(picture.root, ())
+
+    # Gather the drawable elements beneath |element|, whose enclosing
+    # groups are |groups|, as leaves: tuples (order, box, groups, element,
+    # path data or None, id of the referenced definition or None).
+    def collect(self, element, groups):
+        for child in element.childNodes:
+            if child.nodeType != child.ELEMENT_NODE:
+                continue
+            tag = child.tagName
+            if tag == 'defs':
+                for d in child.childNodes:
+                    if d.nodeType == d.ELEMENT_NODE and d.getAttribute('id'):
+                        self.definitions[d.getAttribute('id')] = d
+            elif tag == 'g':
+                self.collect(child, groups + (child,))
+            elif tag == 'path':
+                commands = PathBuilder.fromString(child.getAttribute('d')).commands
+                pieces = splitPath(commands)
+                if len(pieces) <= 1:
+                    self.addLeaf(pathBox(commands), groups, child)
+                else:
+                    for piece in pieces:
+                        path = PathBuilder()
+                        for (command, args) in piece:
+                            path.append(command, args)
+                        self.addLeaf(pathBox(piece), groups, child, str(path))
+            elif tag == 'text':
+                self.addText(child, groups)
+            elif tag == 'rect':
+                (x, y, w, h) = [float(child.getAttribute(a))
+                                for a in ('x', 'y', 'width', 'height')]
+                self.addLeaf((x, y, x + w, y + h), groups, child)
+            elif tag == 'line':
+                (x1, y1, x2, y2) = [float(child.getAttribute(a)) for a in ('x1', 'y1', 'x2', 'y2')]
+                self.addLeaf((min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)), groups, child)
+            else:
+                # Something we can't measure; put it everywhere.
+                size = self.tiles.pageSize
+                self.addLeaf((0, 0, size, size), groups, child)
+
+    # A text element takes the box of the path it follows, widened by its
+    # font size.
+    def addText(self, text, groups):
+        href = None
+        for c in text.childNodes:
+            if c.nodeType == c.ELEMENT_NODE and c.tagName == 'textPath':
+                href = c.getAttribute('xlink:href').lstrip('#')
+        target = self.definitions.get(href)
+        if target is None:
+            return
+        fontSize = 12
+        for e in groups + (text,):
+            if e.getAttribute('font-size'):
+                fontSize = float(e.getAttribute('font-size'))
+        box = pathBox(PathBuilder.fromString(target.getAttribute('d')).commands)
+        self.addLeaf(expand(box, fontSize), groups, text, definition=href)
+
+    def addLeaf(self, box, groups, element, data=None, definition=None):
+        if box is None:
+            return
+        self.leaves.append((len(self.leaves), expand(box, boxMargin), groups, element, data,
+                            definition))
+
+# One zoom level of a TileSet: a TileDrawing at the level's detail, and an
+# index of its leaves by the level's tiles.
+class TileLevel(object):
+    def __init__(self, drawing, zoom):
+        self.drawing = drawing
+        self.tiles = drawing.tiles
+        self.zoom = zoom
+        self.index = GridIndex(self.tiles.pageSize, 2 ** zoom)
+        for leaf in drawing.leaves:
+            self.index.insert(leaf[1], leaf)
+
+    # Write the tile in column |x|, row |y| to |out|.
+    def write(self, x, y, out):
+        span = float(self.tiles.pageSize) / 2 ** self.zoom
+        (x0, y0) = (x * span, y * span)
+        leaves = self.index.query((x0, y0, x0 + span, y0 + span))
+
+        size = self.tiles.tileSize
+        picture = SVGPicture(('%d' % size,) * 2, (size, size))
+        picture.root.setAttribute('viewBox', '%g %g %g %g' % (x0, y0, span, span))
+        doc = picture.doc
+
+        # The label paths the tile's text follows.
+        needed = sorted(set(leaf[5] for leaf in leaves if leaf[5]))
+        if needed:
+            defs = picture.root.appendChild(picture.defs())
+            for id in needed:
+                defs.appendChild(doc.importNode(self.drawing.definitions[id], True))
+
+        # Reopen the leaves' groups as we go, sharing them between
+        # consecutive leaves, and gather consecutive pieces of one path back
+        # into one element.
+        open = []               # (original group, copy)
+        previous = (None, None)  # (original element, copy) of the last path piece
+        for (order, box, groups, element, data, definition) in leaves:
+            n = 0
+            while n < len(open) and n < len(groups) and open[n][0] is groups[n]:
+                n = n + 1
+            if n < len(open):
+                del open[n:]
+                previous = (None, None)
+            for g in groups[n:]:
+                copy = doc.importNode(g, False)
+                (open[-1][1] if open else picture.root).appendChild(copy)
+                open.append((g, copy))
+            parent = open[-1][1] if open else picture.root
+
+            if data is not None and previous[0] is element:
+                copy = previous[1]
+                copy.setAttribute('d', copy.getAttribute('d') + ' ' + data)
+                continue
+            copy = parent.appendChild(doc.importNode(element, True))
+            if data is not None:
+                copy.setAttribute('d', data)
+            previous = (element, copy) if data is not None else (None, None)
+
+        picture.write(out)
+        print >> out
+
+# Each worker's latest drawing and level, as (key, value) pairs.
+# renderTiles finishes each level before starting the next, and the levels
+# sharing a detail are consecutive, so keeping only the latest of each
+# lets levels share a drawing while a worker holds just one full-page
+# drawing at a time.
+latest = {}
+
+def level(tiles, zoom):
+    (key, detail) = (tiles.key(), tiles.detail(zoom))
+    drawing = latest.get('drawing')
+    if drawing is None or drawing[0] != (key, detail):
+        # Let go of the old drawing before making the new one.
+        latest.clear()
+        drawing = latest['drawing'] = ((key, detail), TileDrawing(tiles, detail))
+    current = latest.get('level')
+    if current is None or current[0] != (key, zoom):
+        current = latest['level'] = ((key, zoom), TileLevel(drawing[1], zoom))
+    return current[1]
+
+def tileFile(directory, zoom, x, y):
+    return os.path.join(directory, str(zoom), str(x), '%d.svg' % y)
+
+# Write one tile. This runs in the pool's worker processes.
+def renderTile((tiles, directory, zoom, x, y)):
+    filename = tileFile(directory, zoom, x, y)
+    makeDirectories(os.path.dirname(filename))
+    with open(filename, 'w') as f:
+        level(tiles, zoom).write(x, y, f)
+    return filename
+
+# Write all the tiles of |tiles| to |directory|, on a pool of |processes|
+# processes, reporting progress to |log|.
+def renderTiles(tiles, directory, processes=None, log=sys.stderr):
+    makeDirectories(directory)
+    with open(os.path.join(directory, 'tiles.json'), 'w') as f:
+        json.dump(tiles.description(), f, indent=2, sort_keys=True)
+        print >> f
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        for zoom in xrange(tiles.levels):
+            start = time.time()
+            count = 2 ** zoom
+            jobs = [(tiles, directory, zoom, x, y) for x in xrange(count) for y in xrange(count)]
+            for filename in pool.imap_unordered(renderTile, jobs, max(1, len(jobs) / 64)):
+                pass
+            print >> log, 'level %d: %d tiles, %s detail, %.2fs' % (
+                zoom, len(jobs), detailNames[tiles.detail(zoom)], time.time() - start)
+    finally:
+        pool.close()
+        pool.join()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Render a calendar as zoomable SVG tiles.")
+    parser.add_argument('start', type=parseDate, help="first date, as YYYY-MM-DD")
+    parser.add_argument('end', type=parseDate, help="last date, as YYYY-MM-DD")
+    parser.add_argument('--latitude', type=float, default=45,
+                        help="latitude for the day lengths (default: %(default)s)")
+    parser.add_argument('--levels', type=int, default=4,
+                        help="number of zoom levels (default: %(default)s)")
+    parser.add_argument('--tile-size', type=int, default=256,
+                        help="width and height of each tile, in pixels (default: %(default)s)")
+    parser.add_argument('--spiral-step', type=int, default=10,
+                        help="length of the arcs drawing the spiral, in days "
+                        "(default: %(default)s)")
+    parser.add_argument('-j', '--processes', type=int, default=None,
+                        help="number of worker processes (default: one per CPU)")
+    parser.add_argument('-o', '--output', default='tiles',
+                        help="directory to write the tiles to (default: %(default)s)")
+    args = parser.parse_args()
+
+    tiles = TileSet(args.start, args.end, args.latitude, levels=args.levels,
+                    tileSize=args.tile_size, spiralStep=args.spiral_step)
+    start = time.time()
+    renderTiles(tiles, args.output, args.processes)
+    print >> sys.stderr, 'done in %.2fs' % (time.time() - start)
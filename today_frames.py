@@ -0,0 +1,95 @@
+"""Mark each day of a calendar as today, in turn: as a frame per day, or as
+one animated SVG.
+
+    $ python today_frames.py 2018-06-01 2019-05-31 --latitude 45 -o frames
+    $ python today_frames.py 2018-06-01 2019-05-31 --latitude 45 --full -o frames
+    $ python today_frames.py 2018-06-01 2019-05-31 --latitude 45 --animate year.svg
+
+By default, this writes the calendar once, as frames/base.svg, and then for
+each day a small transparent frames/YYYY-MM-DD.svg holding just that day's
+marker, to lay over the base. With --full, each day's file is instead a
+whole calendar with the day marked. With --animate, it writes a single SVG
+whose marker steps through the days, --seconds per day.
+
+Either way, the calendar is drawn and serialized once, as a
+gen_calendar.CalendarTemplate, and each day costs only its marker.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from batch_render import parseDate
+from fragment_cache import makeDirectories
+from gen_calendar import (CalendarTemplate, DocumentTemplate, SVGPicture, addProfileArguments,
+                          dateRange, profileFromArguments)
+
+# Return a DocumentTemplate for an empty page the size of |template|'s, with
+# a place for one element.
+def overlayDocument(template):
+    page = template.picture
+    picture = SVGPicture(page.realWidthHeight, page.pixelWidthHeight, template.profile)
+    placeholder = picture.root.appendChild(picture.doc.createElement('today-placeholder'))
+    return DocumentTemplate(picture, [placeholder])
+
+# Write a file for each day from |template|'s calendar's start date through
+# its end date to |directory|, named for the date with the extension
+# |extension|. If |full| is true, each is a whole calendar with the day
+# marked; otherwise, each is just the marker, and the calendar itself is
+# written once, as 'base'. Like CalendarTemplate.write, mark only days the
+# calendar includes. Return the number of days written.
+def writeFrames(template, directory, extension, full=False):
+    makeDirectories(directory)
+    mode = 'wb' if template.profile.compress else 'w'
+    calendar = template.calendar
+    if not full:
+        overlay = overlayDocument(template)
+        with open(os.path.join(directory, 'base' + extension), mode) as f:
+            template.write(f)
+
+    count = 0
+    for day in dateRange(calendar.startDate, calendar.endDate, 1):
+        with open(os.path.join(directory, day.isoformat() + extension), mode) as f:
+            if full:
+                template.write(f, today=day)
+            else:
+                overlay.write(f, [calendar.todayMarker(day) if calendar.includes(day) else None])
+        count = count + 1
+    return count
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Mark each day of a calendar as today, as a "
+                                     "series of frames or an animation.")
+    parser.add_argument('start', type=parseDate, help="first date, as YYYY-MM-DD")
+    parser.add_argument('end', type=parseDate, help="last date, as YYYY-MM-DD")
+    parser.add_argument('--latitude', type=float, default=45,
+                        help="latitude for the day lengths (default: %(default)s)")
+    parser.add_argument('-o', '--output', default='frames',
+                        help="directory to write the frames to (default: %(default)s)")
+    parser.add_argument('--full', action='store_true',
+                        help="make each frame a whole calendar, rather than just the marker")
+    parser.add_argument('--animate', metavar='FILE',
+                        help="write a single animated SVG to this file instead of frames")
+    parser.add_argument('--seconds', type=float, default=0.1,
+                        help="how long the animation stays on each day (default: %(default)s)")
+    parser.add_argument('--merge', action='store_true',
+                        help="draw each layer of like shapes as a single path, "
+                        "rather than one element per day")
+    addProfileArguments(parser, 'YYYY-MM-DD')
+    args = parser.parse_args()
+
+    profile = profileFromArguments(args)
+    start = time.time()
+    template = CalendarTemplate(args.start, args.end, args.latitude, profile=profile,
+                                mergePaths=args.merge)
+    drawn = time.time()
+    if args.animate:
+        with open(args.animate, 'wb' if profile.compress else 'w') as f:
+            template.writeAnimation(f, list(dateRange(args.start, args.end, 1)), args.seconds)
+        count = 1
+    else:
+        count = writeFrames(template, args.output, '.svgz' if profile.compress else '.svg',
+                            args.full)
+    print >> sys.stderr, 'template %.2fs; %d files %.2fs' % (drawn - start, count,
+                                                            time.time() - drawn)